@@ -1,5 +1,6 @@
 from .certificate import *  # noqa: F401,F403
 from .certificate_authority import *  # noqa: F401,F403
 from .extended_key_usage import *  # noqa: F401,F403
+from .key_pool import *  # noqa: F401,F403
 from .key_usage import *  # noqa: F401,F403
 from .profile import *  # noqa: F401,F403
@@ -1,7 +1,8 @@
+from django.conf.urls import url
 from django.contrib import admin
 from django.template.response import TemplateResponse
 
-from ca.core.forms import CertificateCreationForm
+from ca.core.forms import CertificateCreationForm, CertificateCSRCreationForm
 from ca.core.internals import encrypt_privkey, get_plain_privkey
 from ca.core.models import Certificate
 from .utils import get_admin_urls
@@ -28,22 +29,48 @@ class CertificateAdmin(X509MixInAdmin):
             ],
         }),
     ]
+    fieldsets_create_csr = [
+        ('General', {
+            'fields': ['profile', 'ca', 'ca_password'],
+        }),
+        ('X509 Basic', {
+            'fields': ['csr'],
+        }),
+    ]
 
     def get_urls(self):
-        urls_add = get_admin_urls(self.model._meta, self.admin_site, [
+        meta = self.model._meta
+        urls_add = get_admin_urls(meta, self.admin_site, [
             ('revoke', CertificateRevocationView),
         ])
+        urls_add.append(url(
+            r'^add/csr/$', self.admin_site.admin_view(self.add_csr_view),
+            name=f'{meta.app_label}_{meta.model_name}_add_csr',
+        ))
         return urls_add + super().get_urls()
 
+    def add_csr_view(self, request):
+        request.csr = True
+        return self.add_view(request, extra_context={
+            'title': 'Add certificate from CSR',
+        })
+
+    def get_fieldsets(self, request, obj=None):
+        if obj is None and getattr(request, 'csr', False):
+            return self.fieldsets_create_csr
+        return super().get_fieldsets(request, obj)
+
     def get_form(self, request, obj=None, **kwargs):
+        if obj is None and getattr(request, 'csr', False):
+            return CertificateCSRCreationForm
         if obj is None:
             return CertificateCreationForm
         return super().get_form(request, obj, **kwargs)
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        if not change:
-            obj = self.model.objects.issue(**form.cleaned_data)
+        obj = super().save_model(request, obj, form, change)
+        # a certificate of a CSR has no private key to show
+        if not change and 'csr' not in form.cleaned_data:
             if not form.cleaned_data['privkey_save']:
                 request.session['privkey'] = obj.private_key_plain
                 request.session['passwd'] = form.cleaned_data['password']
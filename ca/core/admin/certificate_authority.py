@@ -5,6 +5,7 @@ from ca.core.models import CertificateAuthority
 from .utils import get_admin_urls
 from .views import (
     CertificateAuthorityCRLView,
+    CertificateAuthorityDeltaCRLView,
     CertificateAuthorityOCSPView,
     CertificateAuthorityRevocationView,
 )
@@ -40,7 +41,8 @@ class CertificateAuthorityAdmin(X509MixInAdmin):
         ('X509 Extensions (Child)', {
             'fields': [
                 'child_issuer_alt_name', 'child_issuer_url',
-                'child_crl_url', 'child_ocsp_url',
+                'child_crl_url', 'child_delta_crl_url', 'child_ocsp_url',
+                'crl_shards',
             ],
         }),
     ]
@@ -50,16 +52,21 @@ class CertificateAuthorityAdmin(X509MixInAdmin):
         kwargs['fieldsets_update'] = [('X509 - Child', {
             'fields': [
                 'child_issuer_alt_name', 'child_issuer_url',
-                'child_crl_url', 'child_ocsp_url',
+                'child_crl_url', 'child_delta_crl_url', 'child_ocsp_url',
             ],
+        }), ('CRL', {
+            'fields': ['crl_number', 'crl_shards'],
         })]
         kwargs['fields_x509_extra'] = ['name_constraints']
-        kwargs['fields_readonly_extra'] = ['name']
+        kwargs['fields_readonly_extra'] = [
+            'name', 'crl_number', 'crl_shards',
+        ]
         super().__init__(*args, **kwargs)
 
     def get_urls(self):
         urls_add = get_admin_urls(self.model._meta, self.admin_site, [
             ('crl', CertificateAuthorityCRLView),
+            ('delta_crl', CertificateAuthorityDeltaCRLView),
             ('ocsp', CertificateAuthorityOCSPView),
             ('revoke', CertificateAuthorityRevocationView),
         ])
@@ -69,8 +76,3 @@ class CertificateAuthorityAdmin(X509MixInAdmin):
         if obj is None:
             return CertificateAuthorityCreationForm
         return super().get_form(request, obj, **kwargs)
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        if not change:
-            self.model.objects.issue(**form.cleaned_data)
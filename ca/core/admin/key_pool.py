@@ -0,0 +1,20 @@
+from django.contrib import admin
+
+from ca.core.models import KeyPoolStats
+
+
+@admin.register(KeyPoolStats)
+class KeyPoolStatsAdmin(admin.ModelAdmin):
+    list_display = [
+        'algorithm', 'key_size', 'current_depth', 'hits', 'misses',
+        'refilled', 'refill_rate', 'refilled_at',
+    ]
+    list_display_links = None
+    ordering = ('algorithm', 'key_size')
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -5,7 +5,10 @@ from ca.core.models import Profile
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ['id', 'name', 'key_size', 'expire_days', 'description']
+    list_display = [
+        'id', 'name', 'key_algorithm', 'key_size', 'expire_days',
+        'description',
+    ]
     list_display_links = ['name']
     search_fields = ['name', 'description']
     ordering = ('id', )
@@ -14,7 +17,7 @@ class ProfileAdmin(admin.ModelAdmin):
     readonly_fields = [
         'name', 'description', 'key_usage_values', 'key_usage_critical',
         'extended_key_usage_values', 'extended_key_usage_critical',
-        'cn_in_san', 'key_size', 'expire_days',
+        'cn_in_san', 'key_algorithm', 'key_size', 'expire_days',
     ]
 
     def get_readonly_fields(self, request, obj=None):
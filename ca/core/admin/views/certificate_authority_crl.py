@@ -4,12 +4,14 @@ from django.urls import reverse
 from django.views.generic.edit import UpdateView
 
 from ca.core.forms import CertificateAuthorityPasswordForm
-from ca.core.internals import decrypt_passwd
+from ca.core.internals import SigningAgentError
 from ca.core.models import CertificateAuthority
+from ca.core.publish import flush_published, PUBLISH_STATS
 
 
 class CertificateAuthorityCRLView(UpdateView):
     admin_site = None
+    delta = False
     form_class = CertificateAuthorityPasswordForm
     model = CertificateAuthority
     template_name = 'admin/password.html'
@@ -23,27 +25,49 @@ class CertificateAuthorityCRLView(UpdateView):
         context = super().get_context_data(**kwargs)
         context.update(self.admin_site.each_context(self.request))
         context['opts'] = self.model._meta
-        context['title'] = 'Refersh CRL'
-        context['name'] = 'crl'
+        context['title'] = 'Refersh Delta CRL' if self.delta else 'Refersh CRL'
+        context['name'] = 'delta_crl' if self.delta else 'crl'
         context['action'] = 'Refersh'
         return context
 
     def form_valid(self, form):
         ca = self.get_object().load()
-        if ca.saved_password:
-            ca_password = decrypt_passwd(ca.saved_password)
-        else:
+        ca_password = None
+        if not ca.saved_password:
             ca_password = form.cleaned_data['password']
-        CertificateAuthority.objects.refresh_crl(ca, ca_password)
+        failures = PUBLISH_STATS['failures']
+        try:
+            CertificateAuthority.objects.refresh_crl(
+                ca, ca_password, delta=self.delta,
+            )
+        except SigningAgentError as e:
+            messages.add_message(
+                self.request, messages.ERROR, f'Signing agent failed: {e}',
+            )
+            return redirect(self.get_success_url())
+
+        # CRLs are written in the background; wait to report how it went
+        flush_published()
+        if PUBLISH_STATS['failures'] > failures:
+            messages.add_message(
+                self.request, messages.ERROR,
+                'The CRL is generated, but failed to be published: '
+                f'{PUBLISH_STATS["last_error"]}',
+            )
+        else:
+            messages.add_message(
+                self.request, messages.SUCCESS,
+                'The CRL is successfully generated',
+            )
         return redirect(self.get_success_url())
 
     def get_success_url(self):
         meta = self.model._meta
-        messages.add_message(
-            self.request, messages.SUCCESS,
-            'The CRL is successfully generated',
-        )
         return reverse(
             f'admin:{meta.app_label}_{meta.model_name}_change',
             args=[self.get_object().pk],
         )
+
+
+class CertificateAuthorityDeltaCRLView(CertificateAuthorityCRLView):
+    delta = True
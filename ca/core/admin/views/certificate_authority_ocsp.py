@@ -7,8 +7,9 @@ from django.utils import timezone
 from django.views.generic.edit import UpdateView
 
 from ca.core.forms import CertificateAuthorityPasswordForm
-from ca.core.internals import decrypt_passwd
+from ca.core.internals import SigningAgentError
 from ca.core.models import Certificate, CertificateAuthority, Profile
+from ca.core.ocsp import OCSPView
 
 
 class CertificateAuthorityOCSPView(UpdateView):
@@ -34,18 +35,23 @@ class CertificateAuthorityOCSPView(UpdateView):
     def form_valid(self, form):
         ca = self.get_object().load()
         profile = Profile.objects.get(name='ocsp')
-        if ca.saved_password:
-            ca_password = decrypt_passwd(ca.saved_password)
-        else:
+        ca_password = None
+        if not ca.saved_password:
             ca_password = form.cleaned_data['password']
         password = secrets.token_bytes(32)
 
-        ocsp_cert = Certificate.objects.issue(
-            ca=ca, profile=profile, subject=ca.subject,
-            subject_alt_name=ca.subject_alt_name(),
-            password=password, ca_password=ca_password,
-            privkey_save=True, password_save=True,
-        )
+        try:
+            ocsp_cert = Certificate.objects.issue(
+                ca=ca, profile=profile, subject=ca.subject,
+                subject_alt_name=ca.subject_alt_name(),
+                password=password, ca_password=ca_password,
+                privkey_save=True, password_save=True,
+            )
+        except SigningAgentError as e:
+            messages.add_message(
+                self.request, messages.ERROR, f'Signing agent failed: {e}',
+            )
+            return redirect(self.get_change_url())
         ocsp_cert.save()
 
         if ca.ocsp_certificate:
@@ -55,14 +61,18 @@ class CertificateAuthorityOCSPView(UpdateView):
 
         ca.ocsp_certificate = ocsp_cert
         ca.save()
+        OCSPView.invalidate(ca.name)
         return redirect(self.get_success_url())
 
     def get_success_url(self):
-        meta = self.model._meta
         messages.add_message(
             self.request, messages.SUCCESS,
             'The OCSP certificate is successfully generated',
         )
+        return self.get_change_url()
+
+    def get_change_url(self):
+        meta = self.model._meta
         return reverse(
             f'admin:{meta.app_label}_{meta.model_name}_change',
             args=[self.get_object().pk],
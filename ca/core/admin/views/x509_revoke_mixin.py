@@ -4,6 +4,7 @@ from django.utils import timezone
 from django.views.generic.edit import UpdateView
 
 from ca.core.forms import X509RevocationForm
+from ca.core.ocsp import OCSPView
 
 
 class X509RevocationViewMixIn(UpdateView):
@@ -22,6 +23,7 @@ class X509RevocationViewMixIn(UpdateView):
         instance.revoked_at = timezone.now()
         instance.revoked_reason = data['revoked_reason']
         instance.save()
+        OCSPView.invalidate_x509(instance)
         return super().form_valid(form)
 
     def get_success_url(self):
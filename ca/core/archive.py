@@ -0,0 +1,239 @@
+import os
+import re
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from os import path
+
+from asn1crypto import crl, pem
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ca.core.internals import unarmor_crl
+from ca.core.models import CertificateAuthority, CRLArchive
+
+
+# {ca.id}.{timestamp}[.delta][.{shard}].crl, as written by refresh_crl
+ARCHIVE_FILE_NAME = re.compile(
+    r'^(?P<ca_id>\d+)\.(?P<timestamp>\d+)(?P<delta>\.delta)?'
+    r'(\.(?P<shard>\d+))?\.crl$'
+)
+
+
+def get_archive_path(file_name):
+    return path.join(settings.STORAGE_CRL_ARCHIVE_DIR, file_name)
+
+
+def get_segment_prefix(ca_id, this_update):
+    day = this_update.astimezone(dt_timezone.utc).strftime('%Y%m%d')
+    return f'{ca_id}.{day}.'
+
+
+def get_segment_name(ca_id, this_update):
+    # a segment per CA and day; the suffix is renewed on every rewrite
+    prefix = get_segment_prefix(ca_id, this_update)
+    return f'{prefix}{int(timezone.now().timestamp())}.seg'
+
+
+def read_archive(archive):
+    if archive.offset is None:
+        with open(get_archive_path(archive.file_name), 'rb') as f:
+            return f.read()
+
+    with open(get_archive_path(archive.file_name), 'rb') as f:
+        f.seek(archive.offset)
+        data = f.read(archive.length)
+    return pem.armor('X509 CRL', zlib.decompress(data))
+
+
+def get_archived_crl(ca, when, shard=0, delta=False):
+    archives = ca.crl_archives.filter(
+        shard=shard, delta=delta, this_update__lte=when,
+    ).order_by('-this_update')
+
+    # a segment could have been rewritten after the row was read
+    for _ in range(2):
+        archive = archives.first()
+        if not archive:
+            return None
+        try:
+            return read_archive(archive)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def remove_file(file_name):
+    try:
+        os.remove(get_archive_path(file_name))
+    except FileNotFoundError:
+        pass
+
+
+def index_archive_files():
+    indexed = set(CRLArchive.objects.filter(
+        offset__isnull=True,
+    ).values_list('file_name', flat=True))
+    ca_ids = set(CertificateAuthority.objects.values_list('id', flat=True))
+
+    count = 0
+    for file_name in os.listdir(settings.STORAGE_CRL_ARCHIVE_DIR):
+        match = ARCHIVE_FILE_NAME.match(file_name)
+        if not match or file_name in indexed:
+            continue
+        ca_id = int(match.group('ca_id'))
+        if ca_id not in ca_ids:
+            continue
+
+        # CRLs from before CRL numbers were introduced count as zero
+        with open(get_archive_path(file_name), 'rb') as f:
+            data = f.read()
+        tbs_cert_list = crl.CertificateList.load(
+            unarmor_crl(data) if pem.detect(data) else data,
+        )['tbs_cert_list']
+        crl_number = 0
+        for extension in tbs_cert_list['crl_extensions']:
+            if extension['extn_id'].native == 'crl_number':
+                crl_number = extension['extn_value'].native
+
+        CRLArchive.objects.create(
+            ca_id=ca_id, shard=int(match.group('shard') or 0),
+            delta=bool(match.group('delta')), crl_number=crl_number,
+            this_update=datetime.fromtimestamp(
+                int(match.group('timestamp')), dt_timezone.utc,
+            ),
+            file_name=file_name,
+        )
+        count += 1
+    return count
+
+
+def expire_archives(now):
+    expired = CRLArchive.objects.filter(this_update__lt=now - timedelta(
+        days=settings.CRL_ARCHIVE_DAILY_DAYS,
+    ))
+    file_names = set(expired.values_list('file_name', flat=True))
+    count = expired.delete()[0]
+
+    # segments are per day, so an expired day is removed as a whole
+    live = set(CRLArchive.objects.filter(
+        file_name__in=file_names,
+    ).values_list('file_name', flat=True))
+    for file_name in file_names - live:
+        remove_file(file_name)
+    return count
+
+
+def thin_archives(now):
+    hourly_until = now - timedelta(days=settings.CRL_ARCHIVE_HOURLY_DAYS)
+    pack_until = now - timedelta(seconds=settings.CRL_ARCHIVE_PACK_AFTER)
+    rows = CRLArchive.objects.filter(this_update__lt=pack_until).order_by(
+        'ca_id', 'shard', 'delta', '-this_update',
+    ).values_list(
+        'id', 'ca_id', 'shard', 'delta', 'this_update', 'file_name', 'offset',
+    )
+
+    # the latest CRL of every hour (or day, when older) is kept
+    seen, removed, dirty_segments = set(), [], set()
+    for pk, ca_id, shard, delta, this_update, file_name, offset in rows:
+        bucket = this_update.astimezone(dt_timezone.utc).replace(
+            minute=0, second=0, microsecond=0,
+        )
+        if this_update < hourly_until:
+            bucket = bucket.replace(hour=0)
+
+        key = (ca_id, shard, delta, bucket)
+        if key not in seen:
+            seen.add(key)
+            continue
+
+        removed.append(pk)
+        if offset is None:
+            remove_file(file_name)
+        else:
+            dirty_segments.add(file_name)
+
+    for i in range(0, len(removed), 500):
+        CRLArchive.objects.filter(pk__in=removed[i:i + 500]).delete()
+    return len(removed), dirty_segments
+
+
+def pack_archives(now):
+    pack_until = now - timedelta(seconds=settings.CRL_ARCHIVE_PACK_AFTER)
+    loose = CRLArchive.objects.filter(
+        offset__isnull=True, this_update__lt=pack_until,
+    ).order_by('this_update')
+
+    segments, count = {}, 0
+    for archive in loose.iterator():
+        key = get_segment_prefix(archive.ca_id, archive.this_update)
+        if key not in segments:
+            segments[key] = CRLArchive.objects.filter(
+                offset__isnull=False, file_name__startswith=key,
+            ).values_list('file_name', flat=True).first() or (
+                get_segment_name(archive.ca_id, archive.this_update)
+            )
+
+        try:
+            data = read_archive(archive)
+        except FileNotFoundError:
+            archive.delete()
+            continue
+
+        # segments are append-only; rows point at fsynced bytes only
+        file_name = segments[key]
+        data = zlib.compress(unarmor_crl(data))
+        with open(get_archive_path(file_name), 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        CRLArchive.objects.filter(pk=archive.pk).update(
+            file_name=file_name, offset=offset, length=len(data),
+        )
+        remove_file(archive.file_name)
+        count += 1
+    return count
+
+
+def rewrite_segment(file_name):
+    archives = list(CRLArchive.objects.filter(
+        file_name=file_name,
+    ).order_by('this_update'))
+    if not archives:
+        remove_file(file_name)
+        return
+
+    # a new name, so readers holding old offsets never see other bytes
+    new_file_name = get_segment_name(
+        archives[0].ca_id, archives[0].this_update,
+    )
+    if new_file_name == file_name:
+        return
+
+    offsets = []
+    with open(get_archive_path(file_name), 'rb') as src, \
+            open(get_archive_path(new_file_name), 'wb') as dst:
+        for archive in archives:
+            src.seek(archive.offset)
+            offsets.append((archive.pk, dst.tell(), archive.length))
+            dst.write(src.read(archive.length))
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    with transaction.atomic():
+        for pk, offset, length in offsets:
+            CRLArchive.objects.filter(pk=pk).update(
+                file_name=new_file_name, offset=offset, length=length,
+            )
+    remove_file(file_name)
+
+
+def compact_crl_archive(now=None):
+    now = now or timezone.now()
+    expired = expire_archives(now)
+    thinned, dirty_segments = thin_archives(now)
+    for file_name in dirty_segments:
+        rewrite_segment(file_name)
+    packed = pack_archives(now)
+    return expired, thinned, packed
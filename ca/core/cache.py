@@ -0,0 +1,35 @@
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class OCSPFileBasedCache(FileBasedCache):
+    """File-based cache which never culls on the write path.
+
+    Django's file-based cache lists the whole directory on every set and
+    deletes random entries once MAX_ENTRIES is reached, which could drop
+    the CA generation keys. Here only expired entries are swept, at most
+    once every CULL_INTERVAL seconds; responses all expire, generation
+    keys never do.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get('OPTIONS', {}).get(
+            'CULL_INTERVAL', 60,
+        )
+        self._next_cull = time.time() + self._cull_interval
+
+    def _cull(self):
+        if time.time() < self._next_cull:
+            return
+        self._next_cull = time.time() + self._cull_interval
+        self.sweep()
+
+    def sweep(self):
+        for fname in self._list_cache_files():
+            try:
+                with open(fname, 'rb') as f:
+                    self._is_expired(f)
+            except (OSError, EOFError, ValueError):
+                pass
@@ -2,6 +2,7 @@ from collections import OrderedDict
 
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.serialization import Encoding
 from cryptography.x509.oid import NameOID
 
@@ -46,10 +47,39 @@ SAN_NAME_TEXT_MAP = {
 }
 
 # Key and Algorithm Section
-CA_KEY_SIZE = 4096
+KEY_ALGORITHMS = [
+    ('rsa', 'RSA'),
+    ('ec', 'ECDSA'),
+    ('ed25519', 'Ed25519'),
+]
+
+KEY_SIZES = {
+    'rsa': [2048, 3072, 4096],
+    'ec': [256, 384],
+    'ed25519': [256],
+}
+
+EC_CURVES = {
+    256: ec.SECP256R1(),
+    384: ec.SECP384R1(),
+}
 
 HASH_SHA512 = hashes.SHA512()
 
+# RSA signs with SHA-512, ECDSA with the hash matching its curve
+SIGNATURE_HASHES = {
+    'sha256': hashes.SHA256(),
+    'sha384': hashes.SHA384(),
+    'sha512': HASH_SHA512,
+}
+
+# OCSP responses of RSA responders; ECDSA ones sign as above
+OCSP_HASH_ALGO = 'sha256'
+
+OCSP_KEY_HASH_ALGO = 'sha1'
+
+OCSP_CERT_ID_HASH_ALGOS = ['sha1', 'sha256']
+
 
 # ENCODING FORMAT
 PEM_ENCODING = Encoding.PEM
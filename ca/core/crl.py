@@ -0,0 +1,109 @@
+import os
+import time
+from os import path
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.generic.base import View
+
+from ca.core.internals import get_crl_update_times
+
+
+CRL_HEADER_SIZE = 4096
+
+CRL_CONTENT_TYPES = {
+    False: 'application/pkix-crl',
+    True: 'application/x-pem-file',
+}
+
+
+class CRLView(View):
+    _CRL_INFO_CACHE = {}
+
+    http_method_names = ['get', 'head', 'options']
+
+    def get_digest(self, file_path, this_update):
+        try:
+            with open(f'{file_path}.sha256', 'rb') as f:
+                digest, timestamp = f.read().split()
+        except (OSError, ValueError):
+            return None
+
+        # the sidecar could belong to the CRL published before or after
+        if int(timestamp) != int(this_update.timestamp()):
+            return None
+        return digest.decode()
+
+    def get_crl_info(self, file_path):
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            key = (stat.st_mtime_ns, stat.st_size)
+            cached = self._CRL_INFO_CACHE.get(file_path, None)
+            if cached and cached[0] == key:
+                return cached[1]
+
+            this_update, next_update = get_crl_update_times(
+                f.read(CRL_HEADER_SIZE),
+            )
+        crl_info = (
+            this_update, next_update,
+            self.get_digest(file_path, this_update),
+        )
+        self._CRL_INFO_CACHE[file_path] = (key, crl_info)
+        return crl_info
+
+    def is_pem(self, request, pem):
+        return bool(pem) or (
+            CRL_CONTENT_TYPES[True] in request.META.get('HTTP_ACCEPT', '')
+        )
+
+    def get_etag(self, stat, digest, pem):
+        if not digest:
+            return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        return quote_etag(f'{digest}.pem' if pem else digest)
+
+    def get_cache_headers(self, etag, this_update, next_update):
+        max_age = 0
+        if next_update:
+            max_age = max(int(next_update.timestamp() - time.time()), 0)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(this_update.timestamp()),
+            'Cache-Control': (
+                f'max-age={max_age}, public, no-transform, must-revalidate'
+            ),
+            'Vary': 'Accept',
+        }
+        if next_update:
+            headers['Expires'] = http_date(next_update.timestamp())
+        return headers
+
+    def get(self, request, name, pem=None):
+        pem = self.is_pem(request, pem)
+        file_path = path.join(settings.STORAGE_CRL_LIVE_DIR, name)
+        try:
+            this_update, next_update, digest = self.get_crl_info(file_path)
+            f = open(f'{file_path}.pem' if pem else file_path, 'rb')
+        except (OSError, ValueError, IndexError):
+            raise Http404('CRL not found')
+
+        # the file is served by the server (sendfile) through file_wrapper
+        stat = os.fstat(f.fileno())
+        headers = self.get_cache_headers(
+            self.get_etag(stat, digest, pem), this_update, next_update,
+        )
+        response = get_conditional_response(
+            request, etag=headers['ETag'],
+            last_modified=int(this_update.timestamp()),
+        )
+        if response is None:
+            response = FileResponse(f, content_type=CRL_CONTENT_TYPES[pem])
+            response['Content-Length'] = stat.st_size
+        else:
+            f.close()
+
+        for key, value in headers.items():
+            response[key] = value
+        return response
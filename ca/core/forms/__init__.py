@@ -1,4 +1,5 @@
 from .certificate_authority_create import *  # noqa: F401,F403
 from .certificate_authority_password import *  # noqa: F401,F403
 from .certificate_create import *  # noqa: F401,F403
+from .certificate_csr_create import *  # noqa: F401,F403
 from .x509_revoke import *  # noqa: F401,F403
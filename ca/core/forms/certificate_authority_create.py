@@ -40,13 +40,26 @@ class CertificateAuthorityCreationForm(X509CreationFormMixIn):
                 'Saving root password is forbidden',
             )
 
+        crl_shards = self.cleaned_data.get('crl_shards', 1)
+        child_crl_url = self.cleaned_data.get('child_crl_url', None)
+        if crl_shards > 1 and not child_crl_url:
+            self.add_error(
+                'child_crl_url',
+                'Partitioned CRLs need CRL URLs',
+            )
+
     class Meta:
         model = CertificateAuthority
         fields = [
             'name', 'description', 'child_issuer_alt_name',
-            'child_issuer_url', 'child_crl_url', 'child_ocsp_url',
+            'child_issuer_url', 'child_crl_url', 'child_delta_crl_url',
+            'child_ocsp_url', 'crl_shards',
         ]
         help_texts = {
             'child_crl_url': f'Hint: {settings.SITE_URL}crl/name.crl',
+            'child_delta_crl_url': (
+                f'Hint: {settings.SITE_URL}crl/name.delta.crl'
+            ),
             'child_ocsp_url': f'Hint: {settings.SITE_URL}ocsp/name',
+            'crl_shards': 'Hint: name.crl is published as name.0.crl, ...',
         }
@@ -0,0 +1,44 @@
+from django import forms
+
+from ca.core.internals import (
+    get_csr_subject, get_csr_subject_alt_name, load_csr,
+)
+from ca.core.models import Certificate
+from .x509_create_mixin import X509CreationFormMixIn
+
+
+class CertificateCSRCreationForm(X509CreationFormMixIn):
+    # the subject, alt names and key come from the CSR
+    subject = None
+    subject_alt_name = None
+    password = None
+    csr = forms.CharField(
+        widget=forms.Textarea, label='CSR',
+        help_text='PEM encoded PKCS#10 certificate signing request',
+    )
+
+    def clean(self):
+        super().clean()
+
+        csr = self.cleaned_data.get('csr', None)
+        profile = self.cleaned_data.get('profile', None)
+        if csr and profile:
+            # everything issuing reads from the CSR is checked here
+            try:
+                csr = load_csr(csr, profile)
+                self.cleaned_data['subject'] = get_csr_subject(csr)
+            except ValueError as e:
+                self.add_error('csr', str(e))
+            else:
+                self.cleaned_data['subject_alt_name'] = (
+                    get_csr_subject_alt_name(csr)
+                )
+
+    def issue(self):
+        self._meta.model.objects.issue_csr(
+            **self.cleaned_data, obj=self.instance,
+        )
+
+    class Meta:
+        model = Certificate
+        fields = ['ca']
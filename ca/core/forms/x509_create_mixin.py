@@ -2,7 +2,7 @@ from django import forms
 from django.utils import timezone
 
 from ca.core.fields import SubjectField
-from ca.core.internals import decrypt_privkey
+from ca.core.internals import decrypt_privkey, SigningAgentError
 from ca.core.models import CertificateAuthority, Profile
 from ca.core.validators import validate_general_name_multiline
 
@@ -60,9 +60,15 @@ class X509CreationFormMixIn(forms.ModelForm):
                     'ca_password', 'WRONG ca password',
                 )
 
-    def save(self, commit=True):
-        obj = super().save(commit=False)
-        self._meta.model.objects.issue(**self.cleaned_data, obj=obj)
-        if commit:
-            obj.save()
-        return obj
+    def _post_clean(self):
+        super()._post_clean()
+
+        # issued once the form is valid, so signing errors show on it
+        if not self.errors:
+            try:
+                self.issue()
+            except SigningAgentError as e:
+                self.add_error(None, f'Signing agent failed: {e}')
+
+    def issue(self):
+        self._meta.model.objects.issue(**self.cleaned_data, obj=self.instance)
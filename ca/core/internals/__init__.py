@@ -1,3 +1,18 @@
-from .cert import issue_cert  # noqa: F401,F403
-from .crl import build_crl  # noqa: F401,F403
+from .agent import (  # noqa: F401,F403
+    AgentKey, get_signing_agent, load_signing_key, SigningAgentError,
+    use_signing_agent,
+)
+from .cert import (  # noqa: F401,F403
+    get_csr_subject, get_csr_subject_alt_name, issue_cert, load_csr,
+)
+from .crl import (  # noqa: F401,F403
+    build_crl, build_crl_digest, encode_crl, get_crl_shard,
+    get_crl_shard_name, get_crl_update_times, unarmor_crl,
+)
 from .crypto import *  # noqa: F401,F403
+from .ocsp import (  # noqa: F401,F403
+    build_ocsp_fail, build_ocsp_response, build_ocsp_responses,
+    build_single_response,
+    get_ocsp_hash_algo, get_ocsp_status, get_ocsp_time,
+    get_ocsp_update_times,
+)
@@ -0,0 +1,194 @@
+import itertools
+import json
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+from .crypto import decrypt_passwd, decrypt_privkey
+
+
+# a frame is (header length, data length), a JSON header and raw data
+AGENT_FRAME = struct.Struct('!II')
+
+AGENT_OPS = ['sign_tbs', 'sign_crl', 'sign_ocsp']
+
+_AGENT_CLIENT = (None, None)
+_AGENT_CLIENT_LOCK = threading.Lock()
+
+
+class SigningAgentError(Exception):
+    pass
+
+
+def write_frame(sock, header, data=b''):
+    header = json.dumps(header).encode()
+    sock.sendall(AGENT_FRAME.pack(len(header), len(data)) + header + data)
+
+
+def read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('Signing agent connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    header_length, data_length = AGENT_FRAME.unpack(
+        read_exactly(sock, AGENT_FRAME.size),
+    )
+    header = json.loads(read_exactly(sock, header_length))
+    return header, read_exactly(sock, data_length)
+
+
+class SigningAgentClient:
+    """Sends signing requests over one socket without waiting for replies.
+
+    Requests of all threads are pipelined; a reader thread hands every
+    reply to the future of its request id.
+    """
+
+    def __init__(self, socket_path, timeout):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.sock = None
+        self.pending = {}
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise SigningAgentError(f'Signing agent is not running: {e}')
+        self.sock = sock
+        threading.Thread(
+            target=self.read_replies, args=(sock,), daemon=True,
+        ).start()
+
+    def read_replies(self, sock):
+        try:
+            while True:
+                header, data = read_frame(sock)
+                with self.lock:
+                    future = self.pending.pop(header['id'], None)
+                if not future:
+                    continue
+                if header.get('error'):
+                    future.set_exception(SigningAgentError(header['error']))
+                else:
+                    future.set_result(data)
+        except Exception as e:
+            # a garbled frame (struct.error, KeyError, ...) ends the
+            # connection too; no request should wait on it any more
+            self.fail(sock, e)
+
+    def fail(self, sock, e):
+        with self.lock:
+            if self.sock is sock:
+                self.sock = None
+            # requests sent on a newer connection are still answered
+            pending = [
+                self.pending.pop(request_id)
+                for request_id, future in list(self.pending.items())
+                if future.sock is sock
+            ]
+        sock.close()
+        for future in pending:
+            future.set_exception(SigningAgentError(str(e)))
+
+    def submit(self, op, name, serial, data):
+        future = Future()
+        with self.lock:
+            if not self.sock:
+                self.connect()
+            request_id = next(self.ids)
+            sock = self.sock
+            future.request_id, future.sock = request_id, sock
+            self.pending[request_id] = future
+            try:
+                write_frame(sock, {
+                    'id': request_id, 'op': op,
+                    'name': name, 'serial': serial,
+                }, data)
+            except OSError as e:
+                # the reader fails what else was sent on this socket
+                self.pending.pop(request_id)
+                self.sock = None
+                future.set_exception(SigningAgentError(str(e)))
+        return future
+
+    def wait(self, futures):
+        try:
+            return [future.result(self.timeout) for future in futures]
+        except FutureTimeoutError:
+            # a late reply finds no future, and is dropped
+            with self.lock:
+                for future in futures:
+                    self.pending.pop(future.request_id, None)
+            raise SigningAgentError('Signing agent timed out')
+
+    def sign(self, op, name, serial, data):
+        return self.wait([self.submit(op, name, serial, data)])[0]
+
+    def sign_many(self, requests):
+        # every request is sent before the first reply is waited for
+        return self.wait([self.submit(*request) for request in requests])
+
+
+def get_signing_agent():
+    global _AGENT_CLIENT
+
+    # a forked process should never share the socket of its parent
+    with _AGENT_CLIENT_LOCK:
+        pid, client = _AGENT_CLIENT
+        if pid != os.getpid():
+            client = SigningAgentClient(
+                settings.SIGNING_AGENT_SOCKET, settings.SIGNING_AGENT_TIMEOUT,
+            )
+            _AGENT_CLIENT = (os.getpid(), client)
+        return client
+
+
+class AgentKey:
+    """Stands in for a private key the signing agent holds."""
+
+    def __init__(self, op, name, serial, public_key):
+        self.op = op
+        self.name = name
+        self.serial = serial
+        self.public_key_obj = public_key
+
+    def public_key(self):
+        return self.public_key_obj
+
+    def sign(self, data, *args):
+        # the agent knows the padding and hash the key signs with
+        return get_signing_agent().sign(self.op, self.name, self.serial, data)
+
+    def sign_many(self, datas):
+        return get_signing_agent().sign_many([
+            (self.op, self.name, self.serial, data) for data in datas
+        ])
+
+
+def use_signing_agent(x509_obj):
+    # the agent unlocks keys by saved passwords; others are never sent
+    return bool(settings.SIGNING_AGENT_SOCKET and x509_obj.saved_password)
+
+
+def load_signing_key(ca, ca_password, op):
+    if use_signing_agent(ca):
+        return AgentKey(op, ca.name, ca.serial, ca.x509.public_key())
+    if not ca_password:
+        ca_password = decrypt_passwd(ca.saved_password)
+    return decrypt_privkey(ca.private_key, ca_password)
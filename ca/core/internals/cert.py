@@ -1,23 +1,124 @@
 from datetime import datetime, timedelta
 
+from asn1crypto import x509 as asn1_x509
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import Encoding
 from cryptography.x509.oid import (
     AuthorityInformationAccessOID, ExtensionOID, ObjectIdentifier
 )
 
-from ca.core.constants import (
-    CA_KEY_SIZE, HASH_SHA512, KEY_USAGES_OID_TEXT_MAP,
-)
+from ca.core.constants import KEY_USAGES_OID_TEXT_MAP, SUBJECT_OID_KEY_MAP
 from ca.core.utils import parse_general_name, parse_subj_name
-from .crypto import decrypt_passwd, decrypt_privkey, generate_privkey
+from .agent import AgentKey, load_signing_key
+from .crl import der_tlv, get_crl_shard, get_crl_shard_urls
+from .crypto import (
+    generate_privkey, get_key_algorithm, get_key_size, get_signature_hash,
+)
+
+
+_LAYOUT_KEYS = {}
+
+
+def to_distribution_points(urls, shard, shards):
+    return [
+        x509.DistributionPoint(full_name=[
+            x509.UniformResourceIdentifier(url),
+        ], relative_name=None, crl_issuer=None, reasons=None)
+        for url in get_crl_shard_urls(urls, shard, shards)
+    ]
+
+
+def get_layout_key(public_key):
+    # only the algorithm of a key shows in a TBS, so any key of it will do
+    algorithm = get_key_algorithm(public_key)
+    if algorithm not in _LAYOUT_KEYS:
+        _LAYOUT_KEYS[algorithm] = generate_privkey(
+            2048 if algorithm == 'rsa' else 256, algorithm,
+        )
+    return _LAYOUT_KEYS[algorithm]
+
+
+def sign_with_agent(builder, agent_key):
+    # a throwaway key lays out the TBS with the algorithm of the CA key;
+    # the agent then signs that TBS with the CA key
+    public_key = agent_key.public_key()
+    cert = builder.sign(
+        private_key=get_layout_key(public_key),
+        algorithm=get_signature_hash(public_key),
+        backend=default_backend(),
+    )
+    tbs_certificate = cert.tbs_certificate_bytes
+    signature_algorithm = asn1_x509.Certificate.load(
+        cert.public_bytes(Encoding.DER),
+    )['signature_algorithm'].dump()
+    signature = agent_key.sign(tbs_certificate)
+    return x509.load_der_x509_certificate(der_tlv(0x30, b''.join([
+        tbs_certificate, signature_algorithm,
+        der_tlv(0x03, b'\x00' + signature),
+    ])), default_backend())
+
+
+def load_csr(csr, profile):
+    if isinstance(csr, str):
+        csr = csr.encode('utf-8')
+    try:
+        csr = x509.load_pem_x509_csr(csr, default_backend())
+    except ValueError:
+        raise ValueError('Invalid PEM encoded CSR')
+
+    # the requester has to hold the private key of the public key
+    if not csr.is_signature_valid:
+        raise ValueError('CSR signature is invalid')
+
+    pubkey = csr.public_key()
+    if get_key_algorithm(pubkey) != profile.key_algorithm or \
+            get_key_size(pubkey) < profile.key_size:
+        raise ValueError(
+            f'CSR key should be {profile.get_key_algorithm_display()} '
+            f'of at least {profile.key_size}b'
+        )
+    return csr
+
+
+def get_csr_subject(csr):
+    subject = {}
+    for attr in csr.subject:
+        if attr.oid not in SUBJECT_OID_KEY_MAP:
+            raise ValueError(
+                f'Unsupported subject attribute: {attr.oid.dotted_string}',
+            )
+        subject[SUBJECT_OID_KEY_MAP[attr.oid]] = attr.value
+    if not subject.get('CN', None):
+        raise ValueError('CSR subject should have a CN')
+    return subject
+
+
+def get_csr_subject_alt_name(csr):
+    # kept as is; not every general name survives a round trip as text
+    try:
+        return csr.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName,
+        ).value
+    except x509.ExtensionNotFound:
+        return None
 
 
 def issue_cert(subject, subject_alt_name, profile,
                ca, ca_password, extension_info, *,
-               path_length=None):
-    privkey = generate_privkey(CA_KEY_SIZE)
-    pubkey = privkey.public_key()
+               path_length=None, privkey=None, pubkey=None):
+    # a public key (of a CSR) is certified as is; no key is generated
+    if pubkey is None:
+        if privkey is None:
+            privkey = generate_privkey(
+                profile.key_size, profile.key_algorithm,
+            )
+        pubkey = privkey.public_key()
+    elif not ca:
+        raise ValueError('A self-signed certificate needs its private key')
+
+    # the serial decides which crl shard will list this certificate
+    serial_number = x509.random_serial_number()
 
     # calc expire date
     now = datetime.utcnow().replace(second=0, microsecond=0)
@@ -28,8 +129,10 @@ def issue_cert(subject, subject_alt_name, profile,
     subj_key_id = x509.SubjectKeyIdentifier.from_public_key(pubkey)
     extension_info.append((subj_key_id, False))
 
-    # append subject alt name
-    if subject_alt_name:
+    # append subject alt name, given as lines or as the extension itself
+    if isinstance(subject_alt_name, x509.SubjectAlternativeName):
+        extension_info.append((subject_alt_name, False))
+    elif subject_alt_name:
         extension_info.append((x509.SubjectAlternativeName([
             parse_general_name(san) for san in subject_alt_name.splitlines()
         ]), False))
@@ -47,9 +150,7 @@ def issue_cert(subject, subject_alt_name, profile,
     else:
         issuer = ca.x509.subject
         issuer_alt_name = ca.child_issuer_alt_name
-        if not ca_password:
-            ca_password = decrypt_passwd(ca.saved_password)
-        sign_privkey = decrypt_privkey(ca.private_key, ca_password)
+        sign_privkey = load_signing_key(ca, ca_password, 'sign_tbs')
         auth_key_id = ca.x509.extensions.get_extension_for_oid(
             ExtensionOID.AUTHORITY_KEY_IDENTIFIER
         ).value
@@ -86,18 +187,16 @@ def issue_cert(subject, subject_alt_name, profile,
             profile.extended_key_usage_critical,
         ))
 
-    # append crl url if exists
+    # append crl url and delta crl url if exists
+    shard = get_crl_shard(ca, serial_number) if ca else 0
     if ca and ca.child_crl_url:
-        crl_urls = [url.strip() for url in ca.child_crl_url.splitlines()]
-        crl_distributions = [
-            x509.DistributionPoint(full_name=[
-                x509.UniformResourceIdentifier(url),
-            ], relative_name=None, crl_issuer=None, reasons=None)
-            for url in crl_urls if url
-        ]
-        extension_info.append((
-            x509.CRLDistributionPoints(crl_distributions), False,
-        ))
+        extension_info.append((x509.CRLDistributionPoints(
+            to_distribution_points(ca.child_crl_url, shard, ca.crl_shards),
+        ), False))
+    if ca and ca.child_delta_crl_url:
+        extension_info.append((x509.FreshestCRL(to_distribution_points(
+            ca.child_delta_crl_url, shard, ca.crl_shards,
+        )), False))
 
     # append ocsp url and issuer url if exists
     auth_info_access = []
@@ -124,13 +223,15 @@ def issue_cert(subject, subject_alt_name, profile,
     builder = builder.issuer_name(issuer)
     builder = builder.not_valid_before(now)
     builder = builder.not_valid_after(expires)
-    builder = builder.serial_number(x509.random_serial_number())
+    builder = builder.serial_number(serial_number)
     builder = builder.public_key(pubkey)
     for extension, critical in extension_info:
         builder = builder.add_extension(extension, critical)
 
+    if isinstance(sign_privkey, AgentKey):
+        return pubkey, privkey, sign_with_agent(builder, sign_privkey)
     return pubkey, privkey, builder.sign(
         private_key=sign_privkey,
-        algorithm=HASH_SHA512,
+        algorithm=get_signature_hash(sign_privkey.public_key()),
         backend=default_backend(),
     )
@@ -1,39 +1,236 @@
-from datetime import datetime, timedelta
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+from os import path
 
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
+from asn1crypto import algos, core, crl, pem
+from asn1crypto import x509 as asn1_x509
 from cryptography.hazmat.primitives.serialization import Encoding
 
-from ca.core.constants import HASH_SHA512
-from .crypto import decrypt_privkey
+from ca.core.utils import parse_serial, split_urls
+from .agent import load_signing_key
+from .crypto import get_signature_algorithm, sign_data
 
 
-def build_revoked_cert(cert):
-    builder = x509.RevokedCertificateBuilder()
-    builder = builder.serial_number(cert.x509.serial)
-    builder = builder.revocation_date(cert.revoked_at)
-    if cert.revoked_reason:
-        reason_flag = getattr(x509.ReasonFlags, cert.revoked_reason)
-        builder = builder.add_extension(
-            x509.CRLReason(reason_flag), critical=False,
+CRL_REASON_EXTENSIONS = {}
+
+CRL_SIGNATURE_ALGORITHMS = {}
+
+
+def get_crl_shard(ca, serial_number):
+    # serials are random, so they spread evenly over the shards
+    return serial_number % ca.crl_shards
+
+
+def get_crl_shard_name(name, shard, shards):
+    # name.crl is published as name.{shard}.crl when the CRL is partitioned
+    if shards <= 1:
+        return name
+    root, ext = path.splitext(name)
+    return f'{root}.{shard}{ext}'
+
+
+def get_crl_shard_urls(urls, shard, shards):
+    return [
+        get_crl_shard_name(url, shard, shards) for url in split_urls(urls)
+    ]
+
+
+def to_general_names(urls):
+    return [asn1_x509.GeneralName(
+        name='uniform_resource_identifier', value=url,
+    ) for url in urls]
+
+
+def der_length(length):
+    if length < 0x80:
+        return bytes([length])
+    size = (length.bit_length() + 7) // 8
+    return bytes([0x80 | size]) + length.to_bytes(size, 'big')
+
+
+def der_tlv(tag, value):
+    return bytes([tag]) + der_length(len(value)) + value
+
+
+def der_integer(value):
+    return der_tlv(0x02, value.to_bytes(
+        value.bit_length() // 8 + 1, 'big', signed=True,
+    ))
+
+
+def der_time(value):
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    if value.year < 2050:
+        return der_tlv(0x17, value.strftime('%y%m%d%H%M%SZ').encode())
+    return der_tlv(0x18, value.strftime('%Y%m%d%H%M%SZ').encode())
+
+
+def der_read_header(data, offset):
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return tag, offset, length
+
+
+def der_read_time(tag, value):
+    if tag == 0x17:
+        return datetime.strptime(value.decode(), '%y%m%d%H%M%SZ').replace(
+            tzinfo=timezone.utc,
         )
-    return builder.build(default_backend())
+    return datetime.strptime(value.decode(), '%Y%m%d%H%M%SZ').replace(
+        tzinfo=timezone.utc,
+    )
+
+
+def get_crl_update_times(data):
+    # only the TBSCertList header is walked, so a prefix of the DER will do
+    _, offset, _ = der_read_header(data, 0)
+    _, offset, _ = der_read_header(data, offset)
+    this_update = None
+    while True:
+        tag, start, length = der_read_header(data, offset)
+        offset = start + length
+        if tag not in (0x17, 0x18):
+            if this_update:
+                return this_update, None
+            continue
+        update = der_read_time(tag, data[start:offset])
+        if this_update:
+            return this_update, update
+        this_update = update
+
+
+def unarmor_crl(crl_pem):
+    # asn1crypto's unarmor is quadratic in the size of the body
+    lines = crl_pem.strip().splitlines()
+    return base64.b64decode(b''.join(lines[1:-1]))
+
+
+def build_crl_digest(crl_der):
+    # the sidecar names the CRL it belongs to by its thisUpdate
+    this_update = get_crl_update_times(crl_der)[0]
+    return (
+        f'{hashlib.sha256(crl_der).hexdigest()} '
+        f'{int(this_update.timestamp())}\n'
+    ).encode()
+
+
+def encode_signature_algorithm(public_key):
+    # RSA signatures carry NULL parameters; ECDSA and Ed25519 none at all
+    algorithm = get_signature_algorithm(public_key)
+    if algorithm not in CRL_SIGNATURE_ALGORITHMS:
+        signature_algorithm = {'algorithm': algorithm}
+        if algorithm.endswith('_rsa'):
+            signature_algorithm['parameters'] = core.Null()
+        CRL_SIGNATURE_ALGORITHMS[algorithm] = algos.SignedDigestAlgorithm(
+            signature_algorithm,
+        ).dump()
+    return CRL_SIGNATURE_ALGORITHMS[algorithm]
+
 
+def encode_reason_extension(revoked_reason):
+    if revoked_reason not in CRL_REASON_EXTENSIONS:
+        CRL_REASON_EXTENSIONS[revoked_reason] = crl.CRLEntryExtensions([{
+            'extn_id': 'crl_reason', 'critical': False,
+            'extn_value': revoked_reason,
+        }]).dump()
+    return CRL_REASON_EXTENSIONS[revoked_reason]
 
-def build_crl(ca, ca_password, cert_revoked, expire_days):
-    now = datetime.utcnow()
-    builder = x509.CertificateRevocationListBuilder()
-    builder = builder.issuer_name(ca.x509.subject)
-    builder = builder.last_update(now)
-    builder = builder.next_update(now + timedelta(days=expire_days))
 
-    for cert in cert_revoked:
-        builder = builder.add_revoked_certificate(build_revoked_cert(cert))
+def encode_revoked_cert(serial_number, revoked_at, revoked_reason):
+    entry = der_integer(serial_number) + der_time(revoked_at)
+    if revoked_reason:
+        entry += encode_reason_extension(revoked_reason)
+    return der_tlv(0x30, entry)
 
-    private_key = decrypt_privkey(ca.private_key, ca_password)
-    crl = builder.sign(
-        private_key=private_key,
-        algorithm=HASH_SHA512,
-        backend=default_backend(),
+
+def build_crl_extensions(crl_number, base_crl_number=None,
+                         freshest_crl_urls=None, distribution_point_urls=None):
+    extensions = [{
+        'extn_id': 'crl_number', 'critical': False,
+        'extn_value': crl_number,
+    }]
+    if base_crl_number is not None:
+        extensions.append({
+            'extn_id': 'delta_crl_indicator', 'critical': True,
+            'extn_value': base_crl_number,
+        })
+    if distribution_point_urls:
+        extensions.append({
+            'extn_id': 'issuing_distribution_point', 'critical': True,
+            'extn_value': {'distribution_point': {
+                'full_name': to_general_names(distribution_point_urls),
+            }},
+        })
+    if freshest_crl_urls:
+        extensions.append({
+            'extn_id': 'freshest_crl', 'critical': False,
+            'extn_value': [{'distribution_point': {
+                'full_name': to_general_names(freshest_crl_urls),
+            }}],
+        })
+    return crl.TBSCertListExtensions(extensions).dump()
+
+
+def encode_crl(issuer, private_key, revoked_certs, this_update, next_update,
+               extensions=None):
+    # entries are encoded one by one and joined once, so building is linear
+    # in the number of revoked certificates
+    revoked_certs = b''.join(
+        encode_revoked_cert(*revoked_cert) for revoked_cert in revoked_certs
     )
-    return crl.public_bytes(Encoding.PEM)
+
+    signature_algorithm = encode_signature_algorithm(private_key.public_key())
+    tbs_cert_list = [
+        der_integer(1), signature_algorithm, issuer,
+        der_time(this_update), der_time(next_update),
+    ]
+    if revoked_certs:
+        tbs_cert_list.append(der_tlv(0x30, revoked_certs))
+    if extensions:
+        tbs_cert_list.append(der_tlv(0xa0, extensions))
+    tbs_cert_list = der_tlv(0x30, b''.join(tbs_cert_list))
+
+    signature = sign_data(private_key, tbs_cert_list)
+    return der_tlv(0x30, b''.join([
+        tbs_cert_list, signature_algorithm,
+        der_tlv(0x03, b'\x00' + signature),
+    ]))
+
+
+def build_crl(ca, ca_password, cert_revoked, expire_days,
+              crl_number=None, base_crl_number=None, shard=0):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    issuer = asn1_x509.Certificate.load(
+        ca.x509.public_bytes(Encoding.DER),
+    ).subject.dump()
+
+    # a base CRL points to its delta CRLs; a delta CRL to its base, and
+    # both name their shard when the CRL is partitioned
+    extensions = None
+    if crl_number is not None:
+        freshest_crl_urls, distribution_point_urls = None, None
+        if base_crl_number is None and ca.child_delta_crl_url:
+            freshest_crl_urls = get_crl_shard_urls(
+                ca.child_delta_crl_url, shard, ca.crl_shards,
+            )
+        if ca.crl_shards > 1 and ca.child_crl_url:
+            distribution_point_urls = get_crl_shard_urls(
+                ca.child_crl_url, shard, ca.crl_shards,
+            )
+        extensions = build_crl_extensions(
+            crl_number, base_crl_number,
+            freshest_crl_urls, distribution_point_urls,
+        )
+
+    private_key = load_signing_key(ca, ca_password, 'sign_crl')
+    crl_der = encode_crl(issuer, private_key, (
+        (parse_serial(serial), revoked_at, revoked_reason)
+        for serial, revoked_at, revoked_reason in cert_revoked
+    ), now, now + timedelta(days=expire_days), extensions)
+    return pem.armor('X509 CRL', crl_der)
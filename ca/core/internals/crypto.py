@@ -1,16 +1,31 @@
 import base64
 import secrets
+import threading
+import time
+from collections import OrderedDict
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import (
+    ec, ed25519, padding, rsa,
+)
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.primitives.serialization import (
     Encoding, PrivateFormat,
 )
 from django.conf import settings
 
+from ca.core.constants import EC_CURVES, SIGNATURE_HASHES
+
+
+# pooled keys are encrypted at rest under a key of their own salt
+KEY_POOL_SALT = b'nyangca key pool'
+
+_FERNET_KEYS = OrderedDict()
+_FERNET_KEYS_LOCK = threading.Lock()
+FERNET_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
 
 def b64enc(b):
     return base64.b64encode(b)
@@ -20,15 +35,50 @@ def b64dec(b):
     return base64.b64decode(b)
 
 
-def get_fernet(salt):
+def clear_fernet_cache():
+    with _FERNET_KEYS_LOCK:
+        FERNET_CACHE_STATS['evictions'] += len(_FERNET_KEYS)
+        _FERNET_KEYS.clear()
+
+
+def derive_fernet_key(salt):
     kdf = Scrypt(
         salt=salt,
         backend=default_backend(),
         **settings.MASTER_PASSWORD_ARGS,
     )
-    return Fernet(b64enc(
-        kdf.derive(settings.MASTER_PASSWORD)
-    ))
+    return kdf.derive(settings.MASTER_PASSWORD)
+
+
+def get_fernet(salt):
+    ttl = settings.MASTER_PASSWORD_CACHE_TTL
+    if not ttl or not settings.MASTER_PASSWORD_CACHE_SIZE:
+        FERNET_CACHE_STATS['misses'] += 1
+        return Fernet(b64enc(derive_fernet_key(salt)))
+
+    # only the entry looked up is checked for expiry; stale entries of
+    # other salts are pushed out by the size bound
+    now = time.monotonic()
+    with _FERNET_KEYS_LOCK:
+        fernet, expires_at = _FERNET_KEYS.get(salt, (None, 0))
+        if expires_at > now:
+            FERNET_CACHE_STATS['hits'] += 1
+            _FERNET_KEYS.move_to_end(salt)
+            return fernet
+        elif fernet:
+            del _FERNET_KEYS[salt]
+            FERNET_CACHE_STATS['evictions'] += 1
+        FERNET_CACHE_STATS['misses'] += 1
+
+    # scrypt runs outside the lock, so misses of other salts never wait
+    fernet = Fernet(b64enc(derive_fernet_key(salt)))
+    with _FERNET_KEYS_LOCK:
+        if salt not in _FERNET_KEYS:
+            _FERNET_KEYS[salt] = (fernet, now + ttl)
+        while len(_FERNET_KEYS) > settings.MASTER_PASSWORD_CACHE_SIZE:
+            _FERNET_KEYS.popitem(last=False)
+            FERNET_CACHE_STATS['evictions'] += 1
+    return fernet
 
 
 def encrypt_passwd(passwd):
@@ -42,11 +92,80 @@ def decrypt_passwd(passwd_stored):
     return get_fernet(b64dec(salt)).decrypt(b64dec(passwd_enc))
 
 
-def generate_privkey(key_size):
-    return rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=key_size,
-        backend=default_backend(),
+def generate_privkey(key_size, algorithm='rsa'):
+    if algorithm == 'rsa':
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=key_size,
+            backend=default_backend(),
+        )
+    elif algorithm == 'ec':
+        return ec.generate_private_key(EC_CURVES[key_size], default_backend())
+    elif algorithm == 'ed25519':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f'Unsupported key algorithm: {algorithm}')
+
+
+def get_key_algorithm(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return 'rsa'
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        return 'ec'
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        return 'ed25519'
+    raise ValueError(f'Unsupported key: {type(public_key).__name__}')
+
+
+def get_key_size(public_key):
+    # Ed25519 keys have one size, which KEY_SIZES lists as 256
+    if get_key_algorithm(public_key) == 'ed25519':
+        return 256
+    return public_key.key_size
+
+
+def get_signature_hash(public_key, hash_algo=None):
+    algorithm = get_key_algorithm(public_key)
+    if algorithm == 'ed25519':
+        return None
+    if hash_algo is None and algorithm == 'ec':
+        hash_algo = 'sha384' if public_key.curve.key_size >= 384 else 'sha256'
+    return SIGNATURE_HASHES[hash_algo or 'sha512']
+
+
+def get_signature_algorithm(public_key, hash_algo=None):
+    # named as asn1crypto names SignedDigestAlgorithm
+    algorithm = get_key_algorithm(public_key)
+    if algorithm == 'ed25519':
+        return 'ed25519'
+    hash_name = get_signature_hash(public_key, hash_algo).name
+    return f'{hash_name}_{"rsa" if algorithm == "rsa" else "ecdsa"}'
+
+
+def sign_data(private_key, data, hash_algo=None):
+    # the public key tells the algorithm, even of a key held elsewhere
+    public_key = private_key.public_key()
+    algorithm = get_key_algorithm(public_key)
+    hash_obj = get_signature_hash(public_key, hash_algo)
+    if algorithm == 'rsa':
+        return private_key.sign(data, padding.PKCS1v15(), hash_obj)
+    elif algorithm == 'ec':
+        return private_key.sign(data, ec.ECDSA(hash_obj))
+    return private_key.sign(data)
+
+
+def generate_pooled_key(algorithm, key_size):
+    privkey = generate_privkey(key_size, algorithm)
+    return get_fernet(KEY_POOL_SALT).encrypt(privkey.private_bytes(
+        encoding=Encoding.DER,
+        format=PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )).decode('utf-8')
+
+
+def load_pooled_key(private_key):
+    return serialization.load_der_private_key(
+        get_fernet(KEY_POOL_SALT).decrypt(private_key.encode('utf-8')),
+        password=None, backend=default_backend(),
     )
 
 
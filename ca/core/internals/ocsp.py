@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+
+from asn1crypto import core, ocsp
+
+from ca.core.constants import OCSP_HASH_ALGO, OCSP_KEY_HASH_ALGO
+from .agent import AgentKey
+from .crypto import get_key_algorithm, get_signature_algorithm, sign_data
+
+
+def get_ocsp_time(value):
+    # GeneralizedTime in OCSP must not carry fractional seconds (RFC 5280)
+    return value.replace(microsecond=0) if value else value
+
+
+def get_ocsp_hash_algo(public_key):
+    # only RSA responders sign with the OCSP hash; ECDSA takes the hash of
+    # its curve and Ed25519 none, as for certificates and CRLs
+    if get_key_algorithm(public_key) == 'rsa':
+        return OCSP_HASH_ALGO
+    return None
+
+
+def get_ocsp_status(revoked_at, revoked_reason):
+    if revoked_at:
+        return revoked_reason or 'revoked'
+    return 'good'
+
+
+def get_ocsp_update_times(data):
+    response = ocsp.OCSPResponse.load(data)
+    basic_response = response['response_bytes']['response'].parsed
+    response_data = basic_response['tbs_response_data']
+    single_response = response_data['responses'][0]
+    return (
+        single_response['this_update'].native,
+        single_response['next_update'].native,
+    )
+
+
+def build_cert_status(status, revoked_at):
+    if status in ['good', 'unknown']:
+        return ocsp.CertStatus(name=status, value=core.Null())
+    return ocsp.CertStatus(name='revoked', value={
+        'revocation_time': get_ocsp_time(revoked_at),
+        'revocation_reason': status if status != 'revoked' else 'unspecified',
+    })
+
+
+def build_single_response(ca_cert, hash_algo, serial_number, status,
+                          revoked_at, this_update, next_update):
+    return {
+        'cert_id': {
+            'hash_algorithm': {'algorithm': hash_algo},
+            'issuer_name_hash': getattr(ca_cert.subject, hash_algo),
+            'issuer_key_hash': getattr(ca_cert.public_key, hash_algo),
+            'serial_number': serial_number,
+        },
+        'cert_status': build_cert_status(status, revoked_at),
+        'this_update': get_ocsp_time(this_update),
+        'next_update': get_ocsp_time(next_update),
+    }
+
+
+def build_ocsp_fail(reason):
+    return ocsp.OCSPResponse({'response_status': reason}).dump()
+
+
+def build_response_data(single_responses, ocsp_cert, nonce=None):
+    response_extensions = None
+    if nonce is not None:
+        response_extensions = [{
+            'extn_id': 'nonce', 'critical': False, 'extn_value': nonce,
+        }]
+
+    return ocsp.ResponseData({
+        'responder_id': ocsp.ResponderId(
+            name='by_key',
+            value=getattr(ocsp_cert.public_key, OCSP_KEY_HASH_ALGO),
+        ),
+        'produced_at': get_ocsp_time(datetime.now(timezone.utc)),
+        'responses': single_responses,
+        'response_extensions': response_extensions,
+    })
+
+
+def encode_ocsp_response(response_data, signature, ocsp_cert, ocsp_key):
+    public_key = ocsp_key.public_key()
+    return ocsp.OCSPResponse({
+        'response_status': 'successful',
+        'response_bytes': {
+            'response_type': 'basic_ocsp_response',
+            'response': {
+                'tbs_response_data': response_data,
+                'signature_algorithm': {
+                    'algorithm': get_signature_algorithm(
+                        public_key, get_ocsp_hash_algo(public_key),
+                    ),
+                },
+                'signature': signature,
+                'certs': [ocsp_cert],
+            },
+        },
+    }).dump()
+
+
+def build_ocsp_response(single_responses, ocsp_cert, ocsp_key, nonce=None):
+    response_data = build_response_data(single_responses, ocsp_cert, nonce)
+    signature = sign_data(
+        ocsp_key, response_data.dump(),
+        get_ocsp_hash_algo(ocsp_key.public_key()),
+    )
+    return encode_ocsp_response(response_data, signature, ocsp_cert, ocsp_key)
+
+
+def build_ocsp_responses(responses, ocsp_cert, ocsp_key):
+    # a signing agent gets every response of the batch before replying
+    response_datas = [
+        build_response_data(single_responses, ocsp_cert)
+        for single_responses in responses
+    ]
+    if isinstance(ocsp_key, AgentKey):
+        signatures = ocsp_key.sign_many([
+            response_data.dump() for response_data in response_datas
+        ])
+    else:
+        hash_algo = get_ocsp_hash_algo(ocsp_key.public_key())
+        signatures = [
+            sign_data(ocsp_key, response_data.dump(), hash_algo)
+            for response_data in response_datas
+        ]
+    return [
+        encode_ocsp_response(response_data, signature, ocsp_cert, ocsp_key)
+        for response_data, signature in zip(response_datas, signatures)
+    ]
@@ -0,0 +1,336 @@
+import json
+import random
+import resource
+import secrets
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+from functools import wraps
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ca.core import managers
+from ca.core.internals import (
+    build_crl, crl as internals_crl, decrypt_passwd, decrypt_privkey,
+    FERNET_CACHE_STATS, get_crl_shard, get_key_algorithm, get_signature_hash,
+)
+from ca.core.models import Certificate, CertificateAuthority, Profile
+from ca.core.utils import format_serial, parse_serial
+
+
+BENCHMARK_REASONS = ['', 'key_compromise', 'superseded', 'unspecified']
+
+# functions timed as the stages of a CRL build
+BENCHMARK_STAGES = [
+    (internals_crl, 'load_signing_key', 'key'),
+    (managers, 'defer', 'publish'),
+    (managers, 'publish_files', 'publish'),
+]
+
+
+def build_legacy_crl(subject, private_key, revoked_certs,
+                     this_update, next_update):
+    # the builder loop CRLs were generated with before encode_crl
+    builder = x509.CertificateRevocationListBuilder()
+    builder = builder.issuer_name(subject)
+    builder = builder.last_update(this_update)
+    builder = builder.next_update(next_update)
+    for serial_number, revoked_at, revoked_reason in revoked_certs:
+        revoked = x509.RevokedCertificateBuilder()
+        revoked = revoked.serial_number(serial_number)
+        revoked = revoked.revocation_date(revoked_at)
+        if revoked_reason:
+            revoked = revoked.add_extension(x509.CRLReason(
+                getattr(x509.ReasonFlags, revoked_reason),
+            ), critical=False)
+        builder = builder.add_revoked_certificate(
+            revoked.build(default_backend()),
+        )
+    return builder.sign(
+        private_key=private_key,
+        algorithm=get_signature_hash(private_key.public_key()),
+        backend=default_backend(),
+    )
+
+
+class TimedKey:
+    def __init__(self, private_key, stages):
+        self.private_key = private_key
+        self.stages = stages
+
+    def __getattr__(self, name):
+        return getattr(self.private_key, name)
+
+    def sign(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.private_key.sign(*args, **kwargs)
+        finally:
+            self.stages['sign'] += time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks build_crl and refresh_crl on a temporary database, '
+        'for growing numbers of revoked certificates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='0,1000,10000,100000,1000000',
+            help='Comma separated numbers of revoked entries',
+        )
+        parser.add_argument(
+            '--shards', type=int, default=1,
+            help='Number of CRL shards of the benchmark CA',
+        )
+        parser.add_argument(
+            '--legacy-limit', type=int, default=10000,
+            help='Largest size also built with the old builder loop',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stages = defaultdict(float)
+
+        # never touch the real database or storage
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+        )
+        try:
+            with tempfile.TemporaryDirectory() as storage_dir, \
+                    override_settings(
+                        STORAGE_CRL_ARCHIVE_DIR=storage_dir,
+                        PUBLISH_ASYNC=False,
+                        PUBLISH_TARGETS={'crl': [{
+                            'BACKEND': 'ca.core.publish.LocalDirectoryBackend',
+                            'OPTIONS': {'location': storage_dir},
+                        }]},
+                    ):
+                results = self.run()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+    def run(self):
+        originals = [
+            (module, attr, getattr(module, attr))
+            for module, attr, _ in BENCHMARK_STAGES
+        ]
+        for (module, attr, func), (_, _, stage) in zip(
+            originals, BENCHMARK_STAGES,
+        ):
+            setattr(module, attr, self.timed(func, stage))
+        managers.build_crl = self.timed_build(build_crl)
+        internals_crl.load_signing_key = self.timed_key(
+            internals_crl.load_signing_key,
+        )
+
+        try:
+            ca = self.seed_ca()
+            results = {
+                'key_algorithm': get_key_algorithm(ca.x509.public_key()),
+                'key_size': ca.profile.key_size,
+                'shards': ca.crl_shards,
+                'sizes': [],
+            }
+            count = 0
+            sizes = sorted(int(s) for s in self.options['sizes'].split(','))
+            for size in sizes:
+                self.stderr.write(f'Seeding {size} revoked certificates...')
+                self.seed_revoked(ca, size - count)
+                count = size
+                results['sizes'].append(self.run_size(ca, size))
+            results['fernet_cache'] = dict(FERNET_CACHE_STATS)
+        finally:
+            managers.build_crl = build_crl
+            for module, attr, func in originals:
+                setattr(module, attr, func)
+        return results
+
+    def timed(self, func, stage):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stages[stage] += time.perf_counter() - start
+        return wrapper
+
+    def timed_key(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return TimedKey(func(*args, **kwargs), self.stages)
+        return wrapper
+
+    def timed_rows(self, rows):
+        # rows are streamed while the CRL is encoded, so fetching them is
+        # timed row by row
+        rows = iter(rows)
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                self.stages['orm'] += time.perf_counter() - start
+            yield row
+
+    def timed_build(self, func):
+        @wraps(func)
+        def wrapper(ca, ca_password, cert_revoked, *args, **kwargs):
+            before = dict(self.stages)
+            start = time.perf_counter()
+            try:
+                return func(
+                    ca, ca_password, self.timed_rows(cert_revoked),
+                    *args, **kwargs,
+                )
+            finally:
+                # encoding is whatever building took besides timed stages
+                elapsed = time.perf_counter() - start
+                self.stages['encode'] += max(elapsed - sum(
+                    self.stages[stage] - before.get(stage, 0)
+                    for stage in ['key', 'orm', 'sign']
+                ), 0)
+        return wrapper
+
+    def seed_ca(self):
+        call_command('loaddata', 'key_usages', verbosity=0)
+        call_command('loaddata', 'extended_key_usages', verbosity=0)
+        call_command('loaddata', 'profiles', verbosity=0)
+
+        ca = CertificateAuthority.objects.issue(
+            name='benchmark', description='',
+            profile=Profile.objects.get(name='ca'),
+            ca=None, ca_password=None, subject={'CN': 'Benchmark CA'},
+            password=secrets.token_bytes(32), password_save=True,
+            path_length=0, subject_alt_name='',
+            name_constraints_permitted='', name_constraints_excluded='',
+            child_issuer_alt_name='', child_issuer_url='',
+            child_crl_url='http://ca.example/crl/benchmark.crl',
+            child_ocsp_url='', crl_shards=self.options['shards'],
+        )
+        ca.save()
+        return CertificateAuthority.objects.get(pk=ca.pk)
+
+    def seed_revoked(self, ca, count):
+        now = timezone.now().replace(microsecond=0)
+        for start in range(0, count, 10000):
+            certs = []
+            for i in range(start, min(start + 10000, count)):
+                serial_number = random.getrandbits(159)
+                certs.append(Certificate(
+                    ca=ca, public_key='', common_name=f'benchmark-{i}',
+                    serial=format_serial(serial_number),
+                    expired_at=now + timedelta(days=365),
+                    revoked_at=now - timedelta(seconds=i),
+                    revoked_reason=BENCHMARK_REASONS[
+                        i % len(BENCHMARK_REASONS)
+                    ],
+                    crl_shard=get_crl_shard(ca, serial_number),
+                ))
+            Certificate.objects.bulk_create(certs)
+
+    def measure(self, func):
+        self.stages = defaultdict(float)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+
+        # ru_maxrss never goes down; sizes run in ascending order, so it
+        # is the peak of the largest run so far
+        return result, {
+            'wall_s': round(elapsed, 4),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'queries': len(queries),
+            'stages_s': {
+                stage: round(seconds, 4)
+                for stage, seconds in sorted(self.stages.items())
+            },
+        }
+
+    def run_size(self, ca, size):
+        rows = Certificate.objects.filter(
+            ca=ca, revoked_at__isnull=False,
+        ).values_list('serial', 'revoked_at', 'revoked_reason')
+
+        crl, result = self.measure(lambda: managers.build_crl(
+            ca, None, rows.iterator(), 10, 1,
+        ))
+        result['crl_bytes'] = len(crl)
+        results = {'revoked': size, 'build_crl': result}
+
+        crls, result = self.measure(
+            lambda: CertificateAuthority.objects.refresh_crl(ca),
+        )
+        result['crl_bytes'] = sum(len(crl) for crl in crls.values())
+        results['refresh_crl'] = result
+
+        if size <= self.options['legacy_limit']:
+            private_key = decrypt_privkey(
+                ca.private_key, decrypt_passwd(ca.saved_password),
+            )
+            revoked_certs = [
+                (parse_serial(serial), revoked_at, revoked_reason)
+                for serial, revoked_at, revoked_reason in rows
+            ]
+            this_update = timezone.now().replace(
+                microsecond=0, tzinfo=None,
+            )
+            start = time.perf_counter()
+            build_legacy_crl(
+                ca.x509.subject, private_key, revoked_certs,
+                this_update, this_update + timedelta(days=1),
+            )
+            results['legacy_builder_s'] = round(
+                time.perf_counter() - start, 4,
+            )
+        return results
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{results["key_algorithm"]}-{results["key_size"]}, '
+            f'{results["shards"]} shard(s)',
+        ))
+        for result in results['sizes']:
+            for name in ['build_crl', 'refresh_crl']:
+                run = result[name]
+                stages = ', '.join(
+                    f'{stage} {seconds}s'
+                    for stage, seconds in run['stages_s'].items()
+                )
+                self.stdout.write(
+                    f'{result["revoked"]:>9} entries  {name:<12}'
+                    f'{run["wall_s"]:>9.3f}s  {run["queries"]:>4} queries  '
+                    f'{run["peak_rss_kb"] // 1024:>6} MiB  '
+                    f'{run["crl_bytes"]:>11} bytes'
+                )
+                self.stdout.write(f'    {stages}')
+            if 'legacy_builder_s' in result:
+                self.stdout.write(
+                    f'    builder loop {result["legacy_builder_s"]}s'
+                )
+        self.stdout.write('master password key cache: ' + ', '.join(
+            f'{name} {count}'
+            for name, count in results['fernet_cache'].items()
+        ))
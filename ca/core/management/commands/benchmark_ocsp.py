@@ -0,0 +1,379 @@
+import base64
+import http.client
+import json
+import random
+import secrets
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from urllib.parse import quote
+
+from asn1crypto import ocsp
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    get_internal_wsgi_application, ThreadedWSGIServer, WSGIRequestHandler,
+)
+from django.db import connection
+from django.test import override_settings, RequestFactory
+from django.utils import timezone
+from oscrypto.keys import parse_certificate
+
+from ca.core.models import Certificate, CertificateAuthority, Profile
+from ca.core.ocsp import OCSPView
+from ca.core.utils import parse_serial
+
+
+# OCSPView methods timed as the stages of a request
+BENCHMARK_STAGES = [
+    ('parse_ocsp_request', 'parse'),
+    ('load_issuer_index', 'db'),
+    ('load_certificates', 'db'),
+    ('get_cached_response', 'cache'),
+    ('get_presigned_response', 'cache'),
+    ('load_builder_data', 'key'),
+    ('sign_response', 'sign'),
+]
+
+BENCHMARK_SCENARIOS = [
+    ('POST', False, 1),
+    ('POST', True, 1),
+    ('POST', True, 'batch'),
+    ('GET', False, 1),
+]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def build_ocsp_request(ca_cert, serials, hash_algo, nonce):
+    request_extensions = None
+    if nonce:
+        request_extensions = [{
+            'extn_id': 'nonce', 'critical': False,
+            'extn_value': secrets.token_bytes(16),
+        }]
+
+    return ocsp.OCSPRequest({'tbs_request': {
+        'request_list': [{'req_cert': {
+            'hash_algorithm': {'algorithm': hash_algo},
+            'issuer_name_hash': getattr(ca_cert.subject, hash_algo),
+            'issuer_key_hash': getattr(ca_cert.public_key, hash_algo),
+            'serial_number': parse_serial(serial),
+        }} for serial in serials],
+        'request_extensions': request_extensions,
+    }}).dump()
+
+
+def check_ocsp_response(status, data):
+    # a fast failure is no result; every response should be a good one
+    if status == 304 and not data:
+        return None
+    elif status != 200:
+        return f'HTTP {status}'
+
+    try:
+        response = ocsp.OCSPResponse.load(data)
+        response_status = response['response_status'].native
+        if response_status != 'successful':
+            return response_status
+        response['response_bytes']['response'].parsed.native
+    except ValueError as e:
+        return f'unparsable response: {e}'
+    return None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the OCSP responder on a temporary database, '
+        'in-process and over a local HTTP server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cas', type=int, default=2)
+        parser.add_argument('--certs', type=int, default=20)
+        parser.add_argument(
+            '--revoked', type=float, default=0.1,
+            help='Ratio of revoked certificates',
+        )
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument(
+            '--batch', type=int, default=4,
+            help='Certificates per batched request',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Parallel clients of the HTTP server',
+        )
+        parser.add_argument(
+            '--no-http', action='store_false', dest='http',
+            help='Benchmark in-process only',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stages = defaultdict(list)
+
+        # never touch the real database, response cache or storage
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+        )
+        try:
+            with tempfile.TemporaryDirectory() as storage_dir, \
+                    override_settings(
+                        OCSP_CACHE='default', STORAGE_OCSP_DIR=storage_dir,
+                    ):
+                self.stderr.write('Seeding certificates...')
+                requests = self.build_requests(self.seed())
+                results = self.run(requests)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+        failed = [
+            f'{transport} {scenario}'
+            for transport, scenarios in results.items()
+            for scenario, result in scenarios.items() if result['errors']
+        ]
+        if failed:
+            raise CommandError(f'Requests failed in: {", ".join(failed)}')
+
+    def seed(self):
+        call_command('loaddata', 'key_usages', verbosity=0)
+        call_command('loaddata', 'extended_key_usages', verbosity=0)
+        call_command('loaddata', 'profiles', verbosity=0)
+
+        ca_profile = Profile.objects.get(name='ca')
+        ocsp_profile = Profile.objects.get(name='ocsp')
+        server_profile = Profile.objects.get(name='server')
+
+        root = CertificateAuthority.objects.issue(
+            name='benchmark-root', description='', profile=ca_profile,
+            ca=None, ca_password=None, subject={'CN': 'Benchmark Root'},
+            password=secrets.token_bytes(32), password_save=True,
+            path_length=1, subject_alt_name='',
+            name_constraints_permitted='', name_constraints_excluded='',
+            child_issuer_alt_name='', child_issuer_url='', child_crl_url='',
+            child_ocsp_url='',
+        )
+        root.save()
+        root = CertificateAuthority.objects.get(pk=root.pk)
+
+        cas = {}
+        for i in range(self.options['cas']):
+            ca = CertificateAuthority.objects.issue(
+                name=f'benchmark-{i}', description='', profile=ca_profile,
+                ca=root, ca_password=None,
+                subject={'CN': f'Benchmark CA {i}'},
+                password=secrets.token_bytes(32), password_save=True,
+                path_length=0, subject_alt_name='',
+                name_constraints_permitted='', name_constraints_excluded='',
+                child_issuer_alt_name='', child_issuer_url='',
+                child_crl_url='', child_ocsp_url='',
+            )
+            ca.save()
+            ca = CertificateAuthority.objects.get(pk=ca.pk)
+
+            ocsp_cert = Certificate.objects.issue(
+                ca=ca, profile=ocsp_profile, subject=ca.subject,
+                subject_alt_name='', password=secrets.token_bytes(32),
+                ca_password=None, privkey_save=True, password_save=True,
+            )
+            ocsp_cert.save()
+            ca.ocsp_certificate = ocsp_cert
+            ca.save()
+
+            serials = []
+            for j in range(self.options['certs']):
+                cert = Certificate.objects.issue(
+                    ca=ca, profile=server_profile,
+                    subject={'CN': f'benchmark-{i}-{j}.example'},
+                    subject_alt_name='', password=None, ca_password=None,
+                    privkey_save=False,
+                )
+                if random.random() < self.options['revoked']:
+                    cert.revoked_at = timezone.now()
+                    cert.revoked_reason = 'key_compromise'
+                cert.save()
+                serials.append(cert.serial)
+
+            OCSPView.invalidate(ca.name)
+            cas[ca.name] = (
+                parse_certificate(ca.public_key.encode('utf8')), serials,
+            )
+        return cas
+
+    def build_requests(self, cas):
+        requests = {}
+        for method, nonce, batch in BENCHMARK_SCENARIOS:
+            size = self.options['batch'] if batch == 'batch' else batch
+            scenario = f'{method} nonce={nonce} batch={size}'
+            requests[scenario] = []
+            for _ in range(self.options['requests']):
+                name = random.choice(list(cas))
+                ca_cert, serials = cas[name]
+                data = build_ocsp_request(
+                    ca_cert, random.sample(serials, min(size, len(serials))),
+                    random.choice(['sha1', 'sha256']), nonce,
+                )
+                requests[scenario].append((method, name, data))
+        return requests
+
+    def run(self, requests):
+        originals = {
+            attr: OCSPView.__dict__[attr] for attr, _ in BENCHMARK_STAGES
+        }
+        for attr, stage in BENCHMARK_STAGES:
+            setattr(OCSPView, attr, self.timed(originals[attr], stage))
+
+        try:
+            results = {'in-process': self.run_in_process(requests)}
+            if self.options['http']:
+                results['http'] = self.run_http(requests)
+        finally:
+            for attr, func in originals.items():
+                setattr(OCSPView, attr, func)
+        return results
+
+    def timed(self, func, stage):
+        is_classmethod = isinstance(func, classmethod)
+        if is_classmethod:
+            func = func.__func__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stages[stage].append(time.perf_counter() - start)
+
+        return classmethod(wrapper) if is_classmethod else wrapper
+
+    def summarize(self, latencies, errors, elapsed, count):
+        stages, self.stages = self.stages, defaultdict(list)
+        errors = Counter(error for error in errors if error)
+        return {
+            'requests': count,
+            'errors': sum(errors.values()),
+            'error_reasons': dict(errors),
+            'rps': round(count / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'stages_ms': {
+                stage: round(sum(times) * 1000 / count, 3)
+                for stage, times in sorted(stages.items())
+            },
+        }
+
+    def run_in_process(self, requests):
+        factory, view = RequestFactory(), OCSPView.as_view()
+        results = {}
+        for scenario, entries in requests.items():
+            latencies, errors = [], []
+            elapsed = time.perf_counter()
+            for method, name, data in entries:
+                if method == 'POST':
+                    request = factory.post(
+                        f'/ocsp/{name}', data,
+                        content_type='application/ocsp-request',
+                    )
+                    kwargs = {'name': name}
+                else:
+                    data = base64.b64encode(data).decode()
+                    request = factory.get(f'/ocsp/{name}/{quote(data)}')
+                    kwargs = {'name': name, 'data': data}
+
+                start = time.perf_counter()
+                response = view(request, **kwargs)
+                latencies.append(time.perf_counter() - start)
+                errors.append(check_ocsp_response(
+                    response.status_code, response.content,
+                ))
+
+            elapsed = time.perf_counter() - elapsed
+            results[scenario] = self.summarize(
+                latencies, errors, elapsed, len(entries),
+            )
+        return results
+
+    def run_http(self, requests):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.daemon_threads = True
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+
+        def send(entry):
+            method, name, data = entry
+            conn = http.client.HTTPConnection(host, port)
+            start = time.perf_counter()
+            if method == 'POST':
+                conn.request('POST', f'/ocsp/{name}', data, {
+                    'Content-Type': 'application/ocsp-request',
+                })
+            else:
+                data = quote(base64.b64encode(data).decode(), safe='')
+                conn.request('GET', f'/ocsp/{name}/{data}')
+            response = conn.getresponse()
+            data = response.read()
+            conn.close()
+            return (
+                time.perf_counter() - start,
+                check_ocsp_response(response.status, data),
+            )
+
+        results = {}
+        try:
+            with ThreadPoolExecutor(self.options['concurrency']) as executor:
+                for scenario, entries in requests.items():
+                    elapsed = time.perf_counter()
+                    latencies, errors = zip(*executor.map(send, entries))
+                    elapsed = time.perf_counter() - elapsed
+                    results[scenario] = self.summarize(
+                        latencies, errors, elapsed, len(entries),
+                    )
+        finally:
+            server.shutdown()
+            server.server_close()
+        return results
+
+    def report(self, results):
+        for transport, scenarios in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(transport))
+            for scenario, result in scenarios.items():
+                stages = ', '.join(
+                    f'{stage} {ms}ms'
+                    for stage, ms in result['stages_ms'].items()
+                )
+                self.stdout.write(
+                    f'  {scenario:<28} {result["rps"]:>8} req/s  '
+                    f'p50 {result["p50_ms"]}ms  p99 {result["p99_ms"]}ms'
+                )
+                self.stdout.write(f'    {stages}')
+                if result['errors']:
+                    reasons = ', '.join(
+                        f'{reason} x{count}'
+                        for reason, count in result['error_reasons'].items()
+                    )
+                    self.stdout.write(self.style.ERROR(
+                        f'    {result["errors"]} errors: {reasons}'
+                    ))
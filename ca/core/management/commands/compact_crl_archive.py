@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from ca.core.archive import compact_crl_archive, index_archive_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Applies the CRL archive retention policy and packs archived CRLs '
+        'into compressed segments. Run it from one process at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index', action='store_true',
+            help='Index archived CRL files written before the archive index',
+        )
+
+    def handle(self, *args, **options):
+        if options['index']:
+            count = index_archive_files()
+            self.stdout.write(f'Indexed {count} archived CRLs')
+
+        expired, thinned, packed = compact_crl_archive()
+        self.stdout.write(
+            f'Expired {expired}, thinned {thinned} '
+            f'and packed {packed} archived CRLs'
+        )
@@ -0,0 +1,189 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from ca.core.models import Certificate, CertificateAuthority
+from ca.core.publish import flush_published
+
+
+def refresh_ca_crl(ca_id, delta, changed_only):
+    ca = CertificateAuthority.objects.get(pk=ca_id)
+    crls = CertificateAuthority.objects.refresh_crl(
+        ca, delta=delta, changed_only=changed_only,
+    )
+
+    # report the refresh only once the files are written
+    flush_published()
+    return sorted(crls)
+
+
+class Command(BaseCommand):
+    help = 'Refreshes CRLs of CAs with saved passwords as they become due.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Refresh all due CRLs once and exit',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of refreshing processes',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2,
+            help='Seconds between database scans',
+        )
+        parser.add_argument(
+            '--lead', type=int, default=60 * 60 * 24,
+            help='Seconds before next update to refresh a base CRL',
+        )
+        parser.add_argument(
+            '--debounce', type=float, default=5,
+            help='Seconds without revocations before a CRL is rebuilt',
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=60,
+            help='Longest seconds a revocation waits for a rebuild',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.pool = None
+        self.running = {}
+        self.pending = {}
+
+        while True:
+            self.collect()
+            for ca_id, name, delta, changed_only in self.rescan():
+                self.submit(ca_id, name, delta, changed_only)
+            if options['once']:
+                wait([task for _, _, task in self.running.values()])
+                self.collect()
+                break
+            time.sleep(options['interval'])
+
+        if self.pool:
+            self.pool.shutdown()
+
+    def get_pool(self):
+        if not self.pool:
+            # forked workers should open their own database connections
+            connections.close_all()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.options['workers'],
+                initializer=django.setup,
+            )
+        return self.pool
+
+    def reset_pool(self, pool):
+        # a worker died; its pool takes no more tasks, so start another
+        if self.pool is pool:
+            self.stderr.write('A CRL worker died, restarting the workers')
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def submit(self, ca_id, name, delta, changed_only):
+        pool = self.get_pool()
+        try:
+            task = pool.submit(refresh_ca_crl, ca_id, delta, changed_only)
+        except BrokenProcessPool:
+            self.reset_pool(pool)
+            pool = self.get_pool()
+            task = pool.submit(refresh_ca_crl, ca_id, delta, changed_only)
+        self.running[ca_id] = (name, pool, task)
+
+    def collect(self):
+        for ca_id, (name, pool, task) in list(self.running.items()):
+            if not task.done():
+                continue
+            del self.running[ca_id]
+            try:
+                shards = task.result()
+            except BrokenProcessPool:
+                # retried on a later scan, as the CRL is still due
+                self.stderr.write(f'Failed to refresh CRL of {name}')
+                self.reset_pool(pool)
+                continue
+            except Exception as e:
+                self.stderr.write(f'Failed to refresh CRL of {name}: {e}')
+                continue
+            if shards:
+                self.stdout.write(
+                    f'Refreshed CRL of {name} (shards: {shards})'
+                )
+
+    def get_revoked_last(self, now):
+        # latest revocation per CA, over both child CAs and certificates
+        revoked_last = {}
+        for model in [Certificate, CertificateAuthority]:
+            rows = model.objects.filter(
+                ca__isnull=False, revoked_at__isnull=False,
+                expired_at__gte=now,
+            ).values_list('ca_id').annotate(Max('revoked_at'))
+            for ca_id, revoked_at in rows:
+                revoked_last[ca_id] = max(
+                    revoked_at, revoked_last.get(ca_id, revoked_at),
+                )
+        return revoked_last
+
+    def rescan(self):
+        now, tasks = timezone.now(), []
+        lead = timedelta(seconds=self.options['lead'])
+        delta_refresh = timedelta(days=settings.CRL_DELTA_EXPIRE_DAYS) / 2
+
+        revoked_last = self.get_revoked_last(now)
+        cas = CertificateAuthority.objects.filter(
+            saved_password__isnull=False, revoked_at__isnull=True,
+            expired_at__gte=now,
+        ).annotate(
+            partitions=Count('crl_partitions__next_update'),
+            next_update=Min('crl_partitions__next_update'),
+            updated_first=Min('crl_partitions__updated_at'),
+            updated_last=Max('crl_partitions__updated_at'),
+        ).values_list(
+            'id', 'name', 'crl_shards', 'child_delta_crl_url',
+            'partitions', 'next_update', 'updated_first', 'updated_last',
+        )
+        for (
+            ca_id, name, crl_shards, child_delta_crl_url,
+            partitions, next_update, updated_first, updated_last,
+        ) in cas:
+            if ca_id in self.running:
+                continue
+
+            # every shard needs a base CRL valid for a while
+            if partitions < crl_shards or next_update - lead <= now:
+                self.pending.pop(ca_id, None)
+                tasks.append((ca_id, name, False, False))
+                continue
+
+            # delta CRLs expire quickly, even when nothing was revoked
+            if child_delta_crl_url and updated_first + delta_refresh <= now:
+                self.pending.pop(ca_id, None)
+                tasks.append((ca_id, name, True, False))
+                continue
+
+            revoked_at = revoked_last.get(ca_id, None)
+            if not revoked_at or revoked_at < updated_last:
+                continue
+
+            # coalesce a burst of revocations into one rebuild
+            first_seen = self.pending.setdefault(ca_id, time.time())
+            quiet = time.time() - revoked_at.timestamp()
+            if (
+                self.options['once']
+                or quiet >= self.options['debounce']
+                or time.time() - first_seen >= self.options['max_delay']
+            ):
+                del self.pending[ca_id]
+                tasks.append((ca_id, name, bool(child_delta_crl_url), True))
+        return tasks
@@ -0,0 +1,111 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ca.core.internals import generate_pooled_key
+from ca.core.models import KeyPoolStats, PooledKey
+
+
+class Command(BaseCommand):
+    help = 'Keeps a stock of pre-generated keys for issuance.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Fill the pool once and exit',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of key generating processes',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1,
+            help='Seconds between pool depth checks',
+        )
+        parser.add_argument(
+            '--size', type=int, default=settings.KEY_POOL_SIZE,
+            help='Number of keys to keep of each algorithm and size',
+        )
+        parser.add_argument(
+            '--low-watermark', type=int,
+            default=settings.KEY_POOL_LOW_WATERMARK,
+            help='Depth below which a pool is refilled',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.pool = None
+        self.running = {key: [] for key in settings.KEY_POOL_KEYS}
+        self.refilled = {key: (0, time.time()) for key in self.running}
+
+        while True:
+            depths = PooledKey.objects.get_depths()
+            for key in self.running:
+                self.collect(key, depths)
+                self.refill(key, depths.get(key, 0) + len(self.running[key]))
+            if options['once']:
+                for key, tasks in self.running.items():
+                    wait(tasks)
+                    self.collect(key, depths)
+                break
+            time.sleep(options['interval'])
+
+        if self.pool:
+            self.pool.shutdown()
+
+    def get_pool(self):
+        if not self.pool:
+            # forked workers should open their own database connections
+            connections.close_all()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.options['workers'],
+                initializer=django.setup,
+            )
+        return self.pool
+
+    def refill(self, key, depth):
+        # a pool is topped up only once it runs low, in one batch
+        if depth >= self.options['low_watermark'] and not self.options['once']:
+            return
+        if depth < self.options['size'] and not self.running[key]:
+            self.refilled[key] = (0, time.time())
+        for _ in range(self.options['size'] - depth):
+            self.running[key].append(
+                self.get_pool().submit(generate_pooled_key, *key),
+            )
+
+    def collect(self, key, depths):
+        done = [task for task in self.running[key] if task.done()]
+        if not done:
+            return
+        self.running[key] = [
+            task for task in self.running[key] if task not in done
+        ]
+
+        keys = []
+        for task in done:
+            try:
+                keys.append(task.result())
+            except Exception as e:
+                self.stderr.write(f'Failed to generate {key}: {e}')
+        PooledKey.objects.bulk_create([
+            PooledKey(algorithm=key[0], key_size=key[1], private_key=data)
+            for data in keys
+        ])
+        depths[key] = depths.get(key, 0) + len(keys)
+
+        # the refill rate is over the batch since the pool last ran low
+        count, since = self.refilled[key]
+        count += len(keys)
+        self.refilled[key] = (count, since)
+        rate = count / max(time.time() - since, 1e-3)
+        KeyPoolStats.objects.record_refill(*key, depths[key], count, rate)
+        self.stdout.write(
+            f'{key[0]}-{key[1]}: depth {depths[key]}, '
+            f'refilled {count} keys ({rate:.2f} keys/s)'
+        )
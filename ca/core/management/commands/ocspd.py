@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application, run
+
+from ca.core.ocsp import OCSPView
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a standalone OCSP responder on the Django development '
+        'server, for development only. In production, serve '
+        'nyangca.ocsp_wsgi with gunicorn -c nyangca/ocsp_gunicorn.py, or '
+        'nyangca.asgi with uvicorn.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8080)
+        parser.add_argument(
+            '--no-warmup', action='store_false', dest='warmup',
+            help='Do not load OCSP signing data before serving',
+        )
+        parser.add_argument(
+            '--warmup-only', action='store_true',
+            help='Load OCSP signing data (checking it loads) and exit',
+        )
+
+    def handle(self, *args, **options):
+        if 'django.contrib.admin' in settings.INSTALLED_APPS:
+            self.stderr.write(self.style.WARNING(
+                'Full site settings are in use; '
+                'nyangca.ocsp_settings starts faster',
+            ))
+
+        if options['warmup'] or options['warmup_only']:
+            OCSPView.warm_up()
+        if options['warmup_only']:
+            return
+
+        self.stderr.write(self.style.WARNING(
+            'The development server is not for production; '
+            'see nyangca/ocsp_gunicorn.py',
+        ))
+        self.stdout.write(
+            f'Serving OCSP on http://{options["host"]}:{options["port"]}/'
+        )
+        try:
+            run(
+                options['host'], options['port'],
+                get_internal_wsgi_application(), threading=True,
+            )
+        except OSError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            pass
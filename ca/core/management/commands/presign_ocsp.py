@@ -0,0 +1,174 @@
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from ca.core.internals import get_ocsp_time
+from ca.core.models import Certificate, CertificateAuthority
+from ca.core.ocsp import (
+    OCSPView, publish_presigned_responses, remove_presigned_responses,
+)
+from ca.core.publish import flush_published
+from ca.core.utils import parse_serial
+
+
+def sign_ocsp_responses(name, entries, this_update, next_update):
+    view = OCSPView()
+    builder_data = view.get_builder_data(name)
+    if not builder_data:
+        return []
+
+    responses = view.sign_responses(builder_data, [
+        (hash_algo, parse_serial(serial), revoked_at, revoked_reason)
+        for serial, hash_algo, revoked_at, revoked_reason in entries
+    ], this_update, next_update)
+    return [
+        (serial, hash_algo, data)
+        for (serial, hash_algo, _, _), data in zip(entries, responses)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Pre-signs OCSP responses of all live certificates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Sign all due responses once and exit',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of signing processes',
+        )
+        parser.add_argument(
+            '--rescan', type=int, default=60,
+            help='Seconds between certificate database scans',
+        )
+        parser.add_argument(
+            '--chunk', type=int, default=64,
+            help='Responses signed per task',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.pool = None
+        self.queue = []
+        self.schedule = {}
+        self.ocsp_certificates = {}
+
+        rescan_at = 0
+        while True:
+            if time.time() >= rescan_at:
+                self.rescan()
+                rescan_at = time.time() + options['rescan']
+
+            count = self.sign_due()
+            if count:
+                self.stdout.write(f'Signed {count} OCSP responses')
+            if options['once']:
+                break
+
+            wake_at = rescan_at
+            if self.queue:
+                wake_at = min(wake_at, self.queue[0][0])
+            time.sleep(max(wake_at - time.time(), 0))
+
+        if self.pool:
+            self.pool.shutdown()
+
+    def get_pool(self):
+        if not self.pool:
+            # forked workers should open their own database connections
+            connections.close_all()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.options['workers'],
+                initializer=django.setup,
+            )
+        return self.pool
+
+    def push(self, key, revoked_at, revoked_reason, due):
+        self.schedule[key] = (revoked_at, revoked_reason, due)
+        heapq.heappush(self.queue, (due, key))
+
+    def rescan(self):
+        now, live = timezone.now(), set()
+        cas = CertificateAuthority.objects.filter(
+            ocsp_certificate__isnull=False,
+        ).values_list('id', 'name', 'ocsp_certificate_id')
+
+        for ca_id, name, ocsp_certificate_id in cas:
+            # a new responder certificate invalidates every signed response
+            if self.ocsp_certificates.get(name) != ocsp_certificate_id:
+                self.ocsp_certificates[name] = ocsp_certificate_id
+                if self.pool:
+                    self.pool.shutdown()
+                    self.pool = None
+                for key in [k for k in self.schedule if k[0] == name]:
+                    del self.schedule[key]
+
+            certs = Certificate.objects.filter(
+                ca_id=ca_id, expired_at__gte=now,
+            ).values_list('serial', 'revoked_at', 'revoked_reason')
+            for serial, revoked_at, revoked_reason in certs.iterator():
+                key = (name, serial)
+                live.add(key)
+                state = self.schedule.get(key, None)
+                if not state or state[:2] != (revoked_at, revoked_reason):
+                    self.push(key, revoked_at, revoked_reason, time.time())
+
+        for key in set(self.schedule) - live:
+            del self.schedule[key]
+            remove_presigned_responses(*key)
+
+    def sign_due(self):
+        now, due = time.time(), {}
+        while self.queue and self.queue[0][0] <= now:
+            when, key = heapq.heappop(self.queue)
+            state = self.schedule.get(key, None)
+            if state and state[2] == when:
+                due.setdefault(key[0], []).append((key[1], ) + state[:2])
+        if not due:
+            return 0
+
+        this_update = get_ocsp_time(timezone.now())
+        next_update = this_update + timedelta(
+            seconds=settings.OCSP_PRESIGN_VALIDITY,
+        )
+
+        chunk, tasks = self.options['chunk'], []
+        for name, certs in due.items():
+            entries = [
+                (serial, hash_algo, revoked_at, revoked_reason)
+                for serial, revoked_at, revoked_reason in certs
+                for hash_algo in settings.OCSP_PRESIGN_HASH_ALGOS
+            ]
+            tasks += [(name, self.get_pool().submit(
+                sign_ocsp_responses, name, entries[i:i + chunk],
+                this_update, next_update,
+            )) for i in range(0, len(entries), chunk)]
+
+        count = 0
+        for name, task in tasks:
+            responses = task.result()
+            publish_presigned_responses([
+                (name, serial, hash_algo, data)
+                for serial, hash_algo, data in responses
+            ])
+            count += len(responses)
+        flush_published()
+
+        # re-sign when half of the validity period has passed
+        refresh_at = now + settings.OCSP_PRESIGN_VALIDITY / 2
+        for name, certs in due.items():
+            for serial, revoked_at, revoked_reason in certs:
+                self.push(
+                    (name, serial), revoked_at, revoked_reason, refresh_at,
+                )
+        return count
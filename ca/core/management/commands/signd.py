@@ -0,0 +1,201 @@
+import os
+import socketserver
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asn1crypto import crl, ocsp
+from asn1crypto import x509 as asn1_x509
+from cryptography.hazmat.primitives.serialization import Encoding
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from ca.core.constants import OCSP_KEY_HASH_ALGO
+from ca.core.internals import (
+    decrypt_passwd, decrypt_privkey, get_ocsp_hash_algo, sign_data,
+)
+from ca.core.internals.agent import AGENT_OPS, read_frame, write_frame
+from ca.core.models import Certificate, CertificateAuthority
+
+
+UnlockedKey = namedtuple('UnlockedKey', ['key', 'signer_id', 'expires'])
+
+SIGNER_STATUS_FIELDS = ['serial', 'revoked_at', 'expired_at']
+
+
+def get_signer_id(op, data):
+    # the issuer (or OCSP responder) the data names; the agent signs only
+    # for the key it was asked to use
+    if op == 'sign_tbs':
+        return asn1_x509.TbsCertificate.load(data)['issuer'].dump()
+    elif op == 'sign_crl':
+        return crl.TbsCertList.load(data)['issuer'].dump()
+    return ocsp.ResponseData.load(data)['responder_id'].chosen.native
+
+
+def get_signer(op, name, serial, fields=None):
+    # a revoked, expired or replaced signer signs nothing more
+    if op == 'sign_ocsp':
+        queryset = Certificate.objects.filter(ocsp_parent__name=name)
+    else:
+        queryset = CertificateAuthority.objects.filter(name=name)
+    if fields:
+        queryset = queryset.only(*fields)
+
+    try:
+        x509_obj = queryset.get(serial=serial)
+    except ObjectDoesNotExist:
+        raise ValueError(f'{serial} is not the signer of {name}')
+    if x509_obj.status() != 'valid':
+        raise ValueError(f'{serial} is {x509_obj.status()}')
+    return x509_obj
+
+
+def unlock_key(op, name, serial):
+    x509_obj = get_signer(op, name, serial)
+    if not x509_obj.saved_password:
+        raise ValueError(f'{serial} has no saved password')
+
+    cert = asn1_x509.Certificate.load(
+        x509_obj.x509.public_bytes(Encoding.DER),
+    )
+    key = decrypt_privkey(
+        x509_obj.private_key, decrypt_passwd(x509_obj.saved_password),
+    )
+    if op == 'sign_ocsp':
+        return key, getattr(cert.public_key, OCSP_KEY_HASH_ALGO)
+    return key, cert.subject.dump()
+
+
+class SigningAgent:
+    def __init__(self, workers, key_ttl):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.key_ttl = key_ttl
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, op, name, serial):
+        # CA keys sign TBS certificates and CRLs alike
+        kind = 'ocsp' if op == 'sign_ocsp' else 'ca'
+        unlocked = self.keys.get((kind, name, serial), None)
+        if unlocked and unlocked.expires > time.time():
+            # other processes revoke signers; look again on every request
+            close_old_connections()
+            try:
+                get_signer(op, name, serial, SIGNER_STATUS_FIELDS)
+            except ValueError:
+                self.keys.pop((kind, name, serial), None)
+                raise
+            return unlocked
+
+        # keys are unlocked one at a time, and only once
+        with self.lock:
+            unlocked = self.keys.get((kind, name, serial), None)
+            if unlocked and unlocked.expires > time.time():
+                return unlocked
+            close_old_connections()
+            key, signer_id = unlock_key(op, name, serial)
+            unlocked = UnlockedKey(
+                key=key, signer_id=signer_id,
+                expires=time.time() + self.key_ttl,
+            )
+            self.keys[(kind, name, serial)] = unlocked
+            return unlocked
+
+    def sign(self, header, data):
+        op = header['op']
+        if op not in AGENT_OPS:
+            raise ValueError(f'Unknown operation: {op}')
+
+        unlocked = self.get_key(op, header['name'], header['serial'])
+        if get_signer_id(op, data) != unlocked.signer_id:
+            raise ValueError(f'Not signed by {header["name"]}')
+        # OCSP responses are signed with the OCSP hash, like in-process
+        hash_algo = None
+        if op == 'sign_ocsp':
+            hash_algo = get_ocsp_hash_algo(unlocked.key.public_key())
+        return sign_data(unlocked.key, data, hash_algo)
+
+
+class SigningAgentHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # replies go out as soon as they are signed, in any order
+        write_lock = threading.Lock()
+
+        def reply(request_id, task):
+            try:
+                header, data = {'id': request_id}, task.result()
+            except Exception as e:
+                header, data = {'id': request_id, 'error': str(e)}, b''
+            with write_lock:
+                try:
+                    write_frame(self.request, header, data)
+                except OSError:
+                    pass
+
+        agent = self.server.agent
+        while True:
+            try:
+                header, data = read_frame(self.request)
+            except (OSError, ValueError):
+                return
+            task = agent.executor.submit(agent.sign, header, data)
+            task.add_done_callback(
+                lambda task, request_id=header['id']: reply(request_id, task),
+            )
+
+
+class SigningAgentServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the CA signing agent, which holds keys unlocked by saved '
+        'passwords and signs for other processes over a Unix socket.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket', default=settings.SIGNING_AGENT_SOCKET,
+            help='Path of the Unix socket to listen on',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of signing threads',
+        )
+        parser.add_argument(
+            '--key-ttl', type=int, default=60 * 60,
+            help='Seconds before an unlocked key is checked again',
+        )
+
+    def handle(self, *args, **options):
+        socket_path = options['socket']
+        if not socket_path:
+            raise CommandError('Set SIGNING_AGENT_SOCKET or pass --socket')
+
+        # a stale socket is left behind when the agent was killed
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+
+        # only the user running the agent could connect to it
+        umask = os.umask(0o177)
+        try:
+            server = SigningAgentServer(socket_path, SigningAgentHandler)
+        finally:
+            os.umask(umask)
+        server.agent = SigningAgent(options['workers'], options['key_ttl'])
+
+        self.stdout.write(f'Signing on {socket_path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(socket_path)
@@ -1,15 +1,22 @@
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import chain
 from os import path
 
 from cryptography import x509
+from django.apps import apps
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Max
 from django.utils import timezone
 
 from ca.core.internals import (
-    build_crl, decrypt_passwd, encrypt_passwd,
-    encrypt_privkey, issue_cert,
+    build_crl, build_crl_digest, encrypt_passwd,
+    encrypt_privkey, get_crl_shard, get_crl_shard_name,
+    get_csr_subject, get_csr_subject_alt_name, issue_cert, load_csr,
+    load_pooled_key, unarmor_crl,
 )
+from ca.core.publish import defer, publish_files, write_files
 from ca.core.utils import parse_general_name, setattrs
 
 
@@ -18,7 +25,8 @@ class CertificateAuthorityManager(models.Manager):
               subject, password, password_save, path_length, subject_alt_name,
               name_constraints_permitted, name_constraints_excluded,
               child_issuer_alt_name, child_issuer_url, child_crl_url,
-              child_ocsp_url, obj=None):
+              child_ocsp_url, child_delta_crl_url='', crl_shards=1,
+              obj=None):
         extension_info = []
         if name_constraints_permitted or name_constraints_excluded:
             def to_subtrees(lines):
@@ -32,60 +40,154 @@ class CertificateAuthorityManager(models.Manager):
                 excluded_subtrees=to_subtrees(name_constraints_excluded),
             ), True))
 
+        # CA keys never come from the pool, they are generated right here
         pubkey, privkey, cert = issue_cert(
             subject, subject_alt_name, profile,
-            ca, ca_password, extension_info,
-            path_length=path_length,
+            ca, ca_password, extension_info, path_length=path_length,
         )
 
         if obj is None:
             obj = self.model()
         setattrs(
             obj, name=name, description=description, profile=profile, ca=ca,
+            crl_shard=get_crl_shard(ca, cert.serial_number) if ca else 0,
+            crl_shards=crl_shards,
             child_issuer_alt_name=child_issuer_alt_name,
             child_issuer_url=child_issuer_url, child_crl_url=child_crl_url,
+            child_delta_crl_url=child_delta_crl_url,
             child_ocsp_url=child_ocsp_url, x509=cert,
             private_key=encrypt_privkey(privkey, password),
             saved_password=encrypt_passwd(password) if password_save else None,
         )
         return obj
 
-    def refresh_crl(self, ca, password=None):
+    def next_crl_number(self, ca):
+        # base and delta CRLs share one monotonically increasing sequence
+        with transaction.atomic():
+            self.filter(pk=ca.pk).update(crl_number=F('crl_number') + 1)
+            ca.crl_number = self.values_list(
+                'crl_number', flat=True,
+            ).get(pk=ca.pk)
+        return ca.crl_number
+
+    def get_changed_crl_shards(self, ca, partitions, filters, delta):
+        revoked_last = {}
+        for qs in [ca.children_ca, ca.children]:
+            rows = qs.filter(**filters).values_list('crl_shard').annotate(
+                Max('revoked_at'),
+            )
+            for shard, revoked_at in rows:
+                revoked_last[shard] = max(
+                    revoked_at, revoked_last.get(shard, revoked_at),
+                )
+
+        # a base is out of date since the last base, a delta since the
+        # last CRL of the shard
+        changed = set()
+        for shard, partition in partitions.items():
+            since = partition.updated_at if delta else partition.base_at
+            if since is None or (
+                shard in revoked_last and revoked_last[shard] >= since
+            ):
+                changed.add(shard)
+        return changed
+
+    def refresh_crl(self, ca, password=None, delta=False, changed_only=False):
+        # a saved password is unwrapped (or the agent signs) in build_crl
         ca_password, expire_days = password, 365
         if ca.saved_password:
-            ca_password = decrypt_passwd(ca.saved_password)
-            expire_days = 10
-
-        certs = sum([list(qs.filter(
-            revoked_at__isnull=False,
-            expired_at__gte=timezone.now(),
-        )) for qs in [ca.children_ca, ca.children]], [])
-        crl = build_crl(ca, ca_password, certs, expire_days)
-
-        timestamp = int(datetime.utcnow().timestamp())
-        crls_file_path = [
-            path.join(
-                settings.STORAGE_CRL_ARCHIVE_DIR,
-                f'{ca.id}.{timestamp}.crl',
-            ),
-            path.join(
-                settings.STORAGE_CRL_LIVE_DIR, f'{ca.name}.crl',
-            ),
-        ]
-        for crl_file_path in crls_file_path:
-            with open(crl_file_path, 'wb') as f:
-                f.write(crl)
-        return crl
+            ca_password, expire_days = None, 10
+
+        # without a delta CRL URL no certificate points at delta CRLs, so
+        # a base CRL is issued instead
+        delta = delta and bool(ca.child_delta_crl_url)
+
+        now = timezone.now()
+        filters = {'revoked_at__isnull': False, 'expired_at__gte': now}
+        partitions = {
+            shard: ca.crl_partitions.get_or_create(shard=shard)[0]
+            for shard in range(ca.crl_shards)
+        }
+        shards = list(partitions)
+        if changed_only:
+            shards = sorted(self.get_changed_crl_shards(
+                ca, partitions, filters, delta,
+            ))
+
+        crls = {}
+        for shard in shards:
+            partition = partitions[shard]
+
+            # a delta CRL needs a base CRL to be relative to
+            shard_delta = delta and partition.base_at is not None
+
+            # stream (serial, revoked_at, revoked_reason) rows of the shard;
+            # no PEM is parsed
+            shard_filters = dict(filters, crl_shard=shard)
+            if shard_delta:
+                shard_filters['revoked_at__gte'] = partition.base_at
+            certs = chain.from_iterable(qs.filter(**shard_filters).values_list(
+                'serial', 'revoked_at', 'revoked_reason',
+            ).iterator() for qs in [ca.children_ca, ca.children])
+
+            crl_number = self.next_crl_number(ca)
+            if shard_delta:
+                crl = build_crl(
+                    ca, ca_password, certs, settings.CRL_DELTA_EXPIRE_DAYS,
+                    crl_number, partition.base_number, shard,
+                )
+            else:
+                crl = build_crl(
+                    ca, ca_password, certs, expire_days,
+                    crl_number, None, shard,
+                )
+                setattrs(
+                    partition, base_number=crl_number, base_at=now,
+                    next_update=now + timedelta(days=expire_days),
+                )
+            partition.updated_at = now
+            partition.save()
+
+            # live CRLs are served as DER, and as PEM on request
+            suffix = '.delta.crl' if shard_delta else '.crl'
+            timestamp = int(datetime.utcnow().timestamp())
+            live_file_name = get_crl_shard_name(
+                f'{ca.name}{suffix}', shard, ca.crl_shards,
+            )
+            archive_file_name = get_crl_shard_name(
+                f'{ca.id}.{timestamp}{suffix}', shard, ca.crl_shards,
+            )
+            crl_der = unarmor_crl(crl)
+
+            # DER goes last, so its sidecar digest and PEM are there first
+            defer(write_files, [(path.join(
+                settings.STORAGE_CRL_ARCHIVE_DIR, archive_file_name,
+            ), crl)])
+            publish_files('crl', [
+                (f'{live_file_name}.pem', crl),
+                (f'{live_file_name}.sha256', build_crl_digest(crl_der)),
+                (live_file_name, crl_der),
+            ])
+
+            # indexed, so archived CRLs are found without listing the dir
+            ca.crl_archives.create(
+                shard=shard, delta=shard_delta, crl_number=crl_number,
+                this_update=now, file_name=archive_file_name,
+            )
+            crls[shard] = crl
+        return crls
 
 
 class CertificateManager(models.Manager):
     def issue(self, ca, profile, subject, subject_alt_name,
               password, ca_password, privkey_save,
               password_save=False, obj=None):
-        pubkey, privkey, cert = issue_cert(
-            subject, subject_alt_name, profile,
-            ca, ca_password, [],
-        )
+        key_pool = apps.get_model('core', 'PooledKey').objects
+        with key_pool.use(profile.key_algorithm, profile.key_size) as privkey:
+            pubkey, privkey, cert = issue_cert(
+                subject, subject_alt_name, profile,
+                ca, ca_password, [], privkey=privkey,
+            )
 
         private_key = None
         if privkey_save:
@@ -96,7 +198,95 @@ class CertificateManager(models.Manager):
 
         setattrs(
             obj, ca=ca, profile=profile, x509=cert,
+            crl_shard=get_crl_shard(ca, cert.serial_number),
             private_key=private_key, private_key_plain=privkey,
             saved_password=encrypt_passwd(password) if password_save else None,
         )
         return obj
+
+    def issue_csr(self, ca, profile, csr, ca_password,
+                  subject=None, subject_alt_name=None, obj=None):
+        # the requester keeps its private key; nothing is generated,
+        # encrypted or stored here
+        csr = load_csr(csr, profile)
+        if subject is None:
+            subject = get_csr_subject(csr)
+        if subject_alt_name is None:
+            subject_alt_name = get_csr_subject_alt_name(csr)
+
+        # extensions come from the profile and the CA, never from the CSR
+        _, _, cert = issue_cert(
+            subject, subject_alt_name, profile,
+            ca, ca_password, [], pubkey=csr.public_key(),
+        )
+
+        if obj is None:
+            obj = self.model()
+
+        setattrs(
+            obj, ca=ca, profile=profile, x509=cert,
+            crl_shard=get_crl_shard(ca, cert.serial_number),
+            private_key=None, private_key_plain=None, saved_password=None,
+        )
+        return obj
+
+
+class PooledKeyManager(models.Manager):
+    def take(self, algorithm, key_size):
+        # concurrent takers race on the delete; only one gets each key
+        for _ in range(3):
+            row = self.filter(
+                algorithm=algorithm, key_size=key_size,
+            ).values_list('pk', 'private_key').first()
+            if not row:
+                break
+            if self.filter(pk=row[0]).delete()[0]:
+                return row[1]
+        return None
+
+    @contextmanager
+    def use(self, algorithm, key_size):
+        # a key keypoold generated ahead, or None to generate one now; a
+        # key that signed into no certificate goes back to the pool
+        private_key = self.take(algorithm, key_size)
+        try:
+            yield load_pooled_key(private_key) if private_key else None
+        except BaseException:
+            if private_key:
+                self.create(
+                    algorithm=algorithm, key_size=key_size,
+                    private_key=private_key,
+                )
+            raise
+        self.record_take(algorithm, key_size, private_key is not None)
+
+    def record_take(self, algorithm, key_size, hit):
+        # counted in the database, so every process adds to one total
+        stats = apps.get_model('core', 'KeyPoolStats').objects
+        counter = 'hits' if hit else 'misses'
+        updated = stats.filter(
+            algorithm=algorithm, key_size=key_size,
+        ).update(**{counter: F(counter) + 1})
+        if not updated:
+            stats.get_or_create(algorithm=algorithm, key_size=key_size)
+            stats.filter(
+                algorithm=algorithm, key_size=key_size,
+            ).update(**{counter: F(counter) + 1})
+
+    def get_depths(self):
+        return {
+            (algorithm, key_size): count
+            for algorithm, key_size, count in self.order_by().values_list(
+                'algorithm', 'key_size',
+            ).annotate(Count('id'))
+        }
+
+
+class KeyPoolStatsManager(models.Manager):
+    def record_refill(self, algorithm, key_size, depth, refilled, rate):
+        self.update_or_create(
+            algorithm=algorithm, key_size=key_size, defaults={
+                'depth': depth, 'refilled': refilled, 'refill_rate': rate,
+                'refilled_at': timezone.now(),
+            },
+        )
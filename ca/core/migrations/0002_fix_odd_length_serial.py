@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from django.db import migrations
+
+from ca.core.utils import format_serial
+
+
+def fix_serial(apps, schema_editor):
+    for model_name in ['Certificate', 'CertificateAuthority']:
+        model = apps.get_model('core', model_name)
+        rows = model.objects.values_list('id', 'serial', 'public_key')
+        for pk, serial, public_key in rows.iterator():
+            cert = x509.load_pem_x509_certificate(
+                public_key.encode('utf-8'), default_backend(),
+            )
+            serial_fixed = format_serial(cert.serial_number)
+            if serial != serial_fixed:
+                model.objects.filter(pk=pk).update(serial=serial_fixed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_serial, migrations.RunPython.noop),
+    ]
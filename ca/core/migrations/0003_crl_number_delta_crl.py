@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ca.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_fix_odd_length_serial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='child_delta_crl_url',
+            field=models.TextField(blank=True, null=True, validators=[ca.core.validators.validate_url_multiline], verbose_name='Delta CRL URLs'),
+        ),
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='crl_number',
+            field=models.PositiveIntegerField(default=0, verbose_name='CRL Number'),
+        ),
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='crl_base_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Base CRL Number'),
+        ),
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='crl_base_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Base CRL At'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_crl_base(apps, schema_editor):
+    CertificateAuthority = apps.get_model('core', 'CertificateAuthority')
+    CRLPartition = apps.get_model('core', 'CRLPartition')
+    rows = CertificateAuthority.objects.filter(
+        crl_base_at__isnull=False,
+    ).values_list('id', 'crl_base_number', 'crl_base_at')
+    for pk, base_number, base_at in rows.iterator():
+        CRLPartition.objects.create(
+            ca_id=pk, shard=0, base_number=base_number, base_at=base_at,
+            updated_at=base_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_crl_number_delta_crl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificate',
+            name='crl_shard',
+            field=models.PositiveIntegerField(default=0, verbose_name='CRL Shard'),
+        ),
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='crl_shard',
+            field=models.PositiveIntegerField(default=0, verbose_name='CRL Shard'),
+        ),
+        migrations.AddField(
+            model_name='certificateauthority',
+            name='crl_shards',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(256)], verbose_name='CRL Shards'),
+        ),
+        migrations.CreateModel(
+            name='CRLPartition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveIntegerField()),
+                ('base_number', models.PositiveIntegerField(blank=True, null=True, verbose_name='Base CRL Number')),
+                ('base_at', models.DateTimeField(blank=True, null=True, verbose_name='Base CRL At')),
+                ('next_update', models.DateTimeField(blank=True, null=True, verbose_name='Next Update')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Updated At')),
+                ('ca', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crl_partitions', to='core.CertificateAuthority', verbose_name='Certificate Authority')),
+            ],
+            options={
+                'verbose_name': 'CRL Partition',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='crlpartition',
+            unique_together=set([('ca', 'shard')]),
+        ),
+        migrations.RunPython(move_crl_base, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='certificateauthority',
+            name='crl_base_at',
+        ),
+        migrations.RemoveField(
+            model_name='certificateauthority',
+            name='crl_base_number',
+        ),
+    ]
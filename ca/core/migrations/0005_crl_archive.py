@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_crl_partition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CRLArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveIntegerField(default=0)),
+                ('delta', models.BooleanField(default=False)),
+                ('crl_number', models.PositiveIntegerField(verbose_name='CRL Number')),
+                ('this_update', models.DateTimeField(verbose_name='This Update')),
+                ('file_name', models.CharField(max_length=64)),
+                ('offset', models.BigIntegerField(blank=True, null=True)),
+                ('length', models.PositiveIntegerField(blank=True, null=True)),
+                ('ca', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crl_archives', to='core.CertificateAuthority', verbose_name='Certificate Authority')),
+            ],
+            options={
+                'verbose_name': 'CRL Archive',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='crlarchive',
+            index_together=set([('ca', 'shard', 'delta', 'this_update')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_crl_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('algorithm', models.CharField(max_length=16)),
+                ('key_size', models.PositiveIntegerField(verbose_name='Key Size')),
+                ('private_key', models.TextField(verbose_name='Private Key')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Pooled Key',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='pooledkey',
+            index_together=set([('algorithm', 'key_size')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_pooled_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='key_algorithm',
+            field=models.CharField(choices=[('rsa', 'RSA'), ('ec', 'ECDSA'), ('ed25519', 'Ed25519')], default='rsa', max_length=16, verbose_name='Key Algorithm'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_profile_key_algorithm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyPoolStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('algorithm', models.CharField(max_length=16)),
+                ('key_size', models.PositiveIntegerField(verbose_name='Key Size')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('misses', models.PositiveIntegerField(default=0)),
+                ('depth', models.PositiveIntegerField(default=0, verbose_name='Depth at Last Refill')),
+                ('refilled', models.PositiveIntegerField(default=0, verbose_name='Keys in Last Refill')),
+                ('refill_rate', models.FloatField(default=0, verbose_name='Refill Rate (keys/s)')),
+                ('refilled_at', models.DateTimeField(blank=True, null=True, verbose_name='Refilled At')),
+            ],
+            options={
+                'verbose_name': 'Key Pool Stats',
+                'verbose_name_plural': 'Key Pool Stats',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='keypoolstats',
+            unique_together=set([('algorithm', 'key_size')]),
+        ),
+    ]
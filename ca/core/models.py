@@ -6,16 +6,19 @@ from cryptography.x509.oid import (
     AuthorityInformationAccessOID, ExtensionOID,
 )
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.utils import timezone
 
 from ca.core.constants import (
-    KEY_USAGES_OID_TEXT_MAP, PEM_ENCODING, REVOCATION_REASONS,
-    SUBJECT_OID_KEY_MAP,
+    KEY_ALGORITHMS, KEY_SIZES, KEY_USAGES_OID_TEXT_MAP, PEM_ENCODING,
+    REVOCATION_REASONS, SUBJECT_OID_KEY_MAP,
 )
+from ca.core.internals import get_ocsp_status
 from ca.core.managers import (
-    CertificateAuthorityManager, CertificateManager,
+    CertificateAuthorityManager, CertificateManager, KeyPoolStatsManager,
+    PooledKeyManager,
 )
 from ca.core.utils import (
     format_general_name, format_general_names, format_serial,
@@ -67,6 +70,10 @@ class Profile(models.Model):
         default=False, verbose_name='ExtendedKeyUsage Critical',
     )
     cn_in_san = models.BooleanField(default=True, verbose_name='CN in SAN')
+    key_algorithm = models.CharField(
+        max_length=16, choices=KEY_ALGORITHMS, default='rsa',
+        verbose_name='Key Algorithm',
+    )
     key_size = models.IntegerField(
         default=4096, validators=[validate_key_size], verbose_name='Key Size',
     )
@@ -78,6 +85,14 @@ class Profile(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        key_sizes = KEY_SIZES.get(self.key_algorithm, [])
+        if self.key_size not in key_sizes:
+            raise ValidationError({'key_size': (
+                f'Key size of {self.get_key_algorithm_display()} should be '
+                f'one of {", ".join(str(size) for size in key_sizes)}'
+            )})
+
 
 class X509MixIn(models.Model):
     public_key = models.TextField(verbose_name='Public Key')
@@ -96,6 +111,9 @@ class X509MixIn(models.Model):
     revoked_reason = models.CharField(
         max_length=32, null=True, blank=True, choices=REVOCATION_REASONS,
     )
+    crl_shard = models.PositiveIntegerField(
+        default=0, verbose_name='CRL Shard',
+    )
 
     x509_obj = None
 
@@ -135,9 +153,7 @@ class X509MixIn(models.Model):
         return 'valid'
 
     def status_ocsp(self):
-        if self.revoked_at:
-            return self.revoked_reason or 'revoked'
-        return 'good'
+        return get_ocsp_status(self.revoked_at, self.revoked_reason)
 
     def load(self):
         self.x509_obj = x509.load_pem_x509_certificate(
@@ -283,6 +299,10 @@ class CertificateAuthority(X509MixIn):
         null=True, blank=True, validators=[validate_url_multiline],
         verbose_name='CRL URLs',
     )
+    child_delta_crl_url = models.TextField(
+        null=True, blank=True, validators=[validate_url_multiline],
+        verbose_name='Delta CRL URLs',
+    )
     child_ocsp_url = models.URLField(
         null=True, blank=True, verbose_name='OCSP URL',
     )
@@ -290,6 +310,13 @@ class CertificateAuthority(X509MixIn):
         'Certificate', null=True, blank=True, on_delete=models.SET_NULL,
         verbose_name='OCSP Certificate', related_name='ocsp_parent',
     )
+    crl_number = models.PositiveIntegerField(
+        default=0, verbose_name='CRL Number',
+    )
+    crl_shards = models.PositiveIntegerField(
+        default=1, validators=[MinValueValidator(1), MaxValueValidator(256)],
+        verbose_name='CRL Shards',
+    )
 
     def name_constraints(self):
         def nc_to_str(nc):
@@ -320,6 +347,72 @@ class CertificateAuthority(X509MixIn):
         return self.name
 
 
+class CRLPartition(models.Model):
+    ca = models.ForeignKey(
+        CertificateAuthority, on_delete=models.CASCADE,
+        verbose_name='Certificate Authority', related_name='crl_partitions',
+    )
+    shard = models.PositiveIntegerField()
+    base_number = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name='Base CRL Number',
+    )
+    base_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Base CRL At',
+    )
+    next_update = models.DateTimeField(
+        null=True, blank=True, verbose_name='Next Update',
+    )
+    updated_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Updated At',
+    )
+
+    class Meta:
+        verbose_name = 'CRL Partition'
+        unique_together = [('ca', 'shard')]
+
+    def __str__(self):
+        return f'{self.ca.name}.{self.shard}'
+
+
+class CRLArchive(models.Model):
+    ca = models.ForeignKey(
+        CertificateAuthority, on_delete=models.CASCADE,
+        verbose_name='Certificate Authority', related_name='crl_archives',
+    )
+    shard = models.PositiveIntegerField(default=0)
+    delta = models.BooleanField(default=False)
+    crl_number = models.PositiveIntegerField(verbose_name='CRL Number')
+    this_update = models.DateTimeField(verbose_name='This Update')
+    file_name = models.CharField(max_length=64)
+    offset = models.BigIntegerField(null=True, blank=True)
+    length = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'CRL Archive'
+        index_together = [('ca', 'shard', 'delta', 'this_update')]
+
+    def __str__(self):
+        return f'{self.ca.name} #{self.crl_number}'
+
+
+class PooledKey(models.Model):
+    objects = PooledKeyManager()
+
+    algorithm = models.CharField(max_length=16)
+    key_size = models.PositiveIntegerField(verbose_name='Key Size')
+    private_key = models.TextField(verbose_name='Private Key')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Created At',
+    )
+
+    class Meta:
+        verbose_name = 'Pooled Key'
+        index_together = [('algorithm', 'key_size')]
+
+    def __str__(self):
+        return f'{self.algorithm}-{self.key_size} #{self.pk}'
+
+
 class Certificate(X509MixIn):
     objects = CertificateManager()
 
@@ -331,3 +424,38 @@ class Certificate(X509MixIn):
 
     def __str__(self):
         return self.common_name
+
+
+class KeyPoolStats(models.Model):
+    objects = KeyPoolStatsManager()
+
+    algorithm = models.CharField(max_length=16)
+    key_size = models.PositiveIntegerField(verbose_name='Key Size')
+    hits = models.PositiveIntegerField(default=0)
+    misses = models.PositiveIntegerField(default=0)
+    depth = models.PositiveIntegerField(
+        default=0, verbose_name='Depth at Last Refill',
+    )
+    refilled = models.PositiveIntegerField(
+        default=0, verbose_name='Keys in Last Refill',
+    )
+    refill_rate = models.FloatField(
+        default=0, verbose_name='Refill Rate (keys/s)',
+    )
+    refilled_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Refilled At',
+    )
+
+    class Meta:
+        verbose_name = 'Key Pool Stats'
+        verbose_name_plural = 'Key Pool Stats'
+        unique_together = [('algorithm', 'key_size')]
+
+    def __str__(self):
+        return f'{self.algorithm}-{self.key_size}'
+
+    def current_depth(self):
+        return PooledKey.objects.filter(
+            algorithm=self.algorithm, key_size=self.key_size,
+        ).count()
+    current_depth.short_description = 'Depth'
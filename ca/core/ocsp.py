@@ -1,45 +1,192 @@
 import base64
+import hashlib
+import os
+import shutil
+import threading
 import time
 import urllib
-from collections import namedtuple
-from datetime import datetime, timedelta
+import uuid
+from collections import namedtuple, OrderedDict
+from datetime import timedelta
+from os import path
 
 from asn1crypto.ocsp import OCSPRequest
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date, parse_http_date, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import View
-from ocspbuilder import OCSPResponseBuilder
-from oscrypto.asymmetric import load_certificate, load_private_key
-from oscrypto.keys import parse_certificate, parse_private
+from oscrypto.keys import parse_certificate
 
-from ca.core.internals import decrypt_passwd
+from ca.core.constants import OCSP_CERT_ID_HASH_ALGOS
+from ca.core.internals import (
+    AgentKey, build_ocsp_fail, build_ocsp_response, build_ocsp_responses,
+    build_single_response,
+    decrypt_passwd, decrypt_privkey, get_ocsp_status, get_ocsp_time,
+    get_ocsp_update_times, use_signing_agent,
+)
 from ca.core.models import Certificate, CertificateAuthority
+from ca.core.publish import publish_files, unpublish_files
 from ca.core.utils import format_serial
 
 
 OCSPBuilderData = namedtuple('OCSPBuilderData', [
-    'ca_public_key', 'ocsp_public_key', 'ocsp_private_key',
-    'ocsp_private_key_passwd', 'expires',
+    'ca_cert', 'ocsp_cert', 'ocsp_key', 'expires',
 ])
 
+OCSPIssuerData = namedtuple('OCSPIssuerData', ['id', 'name'])
+
+OCSPResponseData = namedtuple('OCSPResponseData', ['data', 'generation'])
+
+OCSPLocalResponse = namedtuple('OCSPLocalResponse', ['data', 'expires'])
+
 
 def public_key_to_obj(pem_str):
-    return load_certificate(parse_certificate(pem_str.encode('utf8')))
+    return parse_certificate(pem_str.encode('utf8'))
 
 
 def private_key_to_obj(pem_str, passwd):
-    return load_private_key(parse_private(
-        pem_str.encode('utf8'), decrypt_passwd(passwd),
-    ))
+    return decrypt_privkey(pem_str, decrypt_passwd(passwd))
+
+
+def get_generation_cache_key(name):
+    return f'ocsp:{name}'
+
+
+def get_response_cache_key(name, serial, hash_algo):
+    return f'ocsp:{name}:{serial}:{hash_algo}'
+
+
+def get_presigned_name(name, serial, hash_algo):
+    return f'{name}/{serial.replace(":", "")}.{hash_algo}.der'
+
+
+def get_presigned_path(name, serial=None, hash_algo=None):
+    if serial is None:
+        return path.join(settings.STORAGE_OCSP_DIR, name)
+    return path.join(
+        settings.STORAGE_OCSP_DIR, get_presigned_name(name, serial, hash_algo),
+    )
+
+
+def publish_presigned_responses(responses):
+    publish_files('ocsp', [
+        (get_presigned_name(name, serial, hash_algo), data)
+        for name, serial, hash_algo, data in responses
+    ])
+
+
+def remove_presigned_responses(name, serial=None):
+    # the responder reads local files, so they are removed right away;
+    # other targets get their copy replaced by the next pre-signing
+    if serial is None:
+        shutil.rmtree(get_presigned_path(name), ignore_errors=True)
+        return
+
+    for hash_algo in OCSP_CERT_ID_HASH_ALGOS:
+        try:
+            os.remove(get_presigned_path(name, serial, hash_algo))
+        except FileNotFoundError:
+            pass
+    unpublish_files('ocsp', [
+        get_presigned_name(name, serial, hash_algo)
+        for hash_algo in OCSP_CERT_ID_HASH_ALGOS
+    ])
 
 
 class OCSPView(View):
     _BUILDER_DATA_CACHE = {}
     _BUILDER_DATA_CACHE_TIME = 600
+    _ISSUER_INDEX = {}
+    _ISSUER_INDEX_CACHE_TIME = 600
+    _ISSUER_INDEX_EXPIRES = 0
     _RESPONSE_CACHE_TIME = 600
+    _LOCAL_RESPONSES = OrderedDict()
+    _LOCAL_RESPONSES_LOCK = threading.Lock()
 
     http_method_names = ['get', 'post', 'head', 'options']
+    cacheable = False
+    cache_generation = None
+
+    @classmethod
+    def get_cache(cls):
+        return caches[settings.OCSP_CACHE]
+
+    @classmethod
+    def invalidate(cls, name, serial=None):
+        remove_presigned_responses(name, serial)
+        with cls._LOCAL_RESPONSES_LOCK:
+            for key in [
+                key for key in cls._LOCAL_RESPONSES
+                if key[0] == name and serial in [None, key[1]]
+            ]:
+                del cls._LOCAL_RESPONSES[key]
+        if serial is not None:
+            cls.get_cache().delete_many([
+                get_response_cache_key(name, serial, hash_algo)
+                for hash_algo in OCSP_CERT_ID_HASH_ALGOS
+            ])
+            return
+
+        # responses are stored with the generation of their CA
+        cls._ISSUER_INDEX_EXPIRES = 0
+        cls._BUILDER_DATA_CACHE.pop(name, None)
+        cls.get_cache().set(
+            get_generation_cache_key(name), uuid.uuid4().hex, None,
+        )
+
+    @classmethod
+    def invalidate_x509(cls, obj):
+        if isinstance(obj, CertificateAuthority):
+            cls.invalidate(obj.name)
+            return
+
+        cls.invalidate(obj.ca.name, obj.serial)
+        for ca in obj.ocsp_parent.all():
+            cls.invalidate(ca.name)
+
+    @classmethod
+    def load_issuer_index(cls):
+        issuer_index = {}
+        queryset = CertificateAuthority.objects.values_list(
+            'id', 'name', 'public_key',
+        )
+        for ca_id, name, public_key in queryset:
+            cert = parse_certificate(public_key.encode('utf8'))
+            for hash_algo in OCSP_CERT_ID_HASH_ALGOS:
+                key = (
+                    hash_algo,
+                    getattr(cert.subject, hash_algo),
+                    getattr(cert.public_key, hash_algo),
+                )
+                issuer_index[key] = OCSPIssuerData(id=ca_id, name=name)
+
+        cls._ISSUER_INDEX = issuer_index
+        cls._ISSUER_INDEX_EXPIRES = time.time() + cls._ISSUER_INDEX_CACHE_TIME
+        return issuer_index
+
+    @classmethod
+    def warm_up(cls):
+        # signing data of every CA is loaded before the first request
+        view = cls()
+        view.load_issuer_index()
+        for name in CertificateAuthority.objects.filter(
+            ocsp_certificate__isnull=False,
+        ).values_list('name', flat=True):
+            view.get_builder_data(name)
+
+    def get_issuer_index(self):
+        if time.time() > self._ISSUER_INDEX_EXPIRES:
+            return self.load_issuer_index()
+        return self._ISSUER_INDEX
+
+    def get_issuer_data(self, hash_algo, issuer_name_hash, issuer_key_hash):
+        key = (hash_algo, issuer_name_hash, issuer_key_hash)
+        return self.get_issuer_index().get(key, None)
 
     def load_builder_data(self, name):
         try:
@@ -51,11 +198,20 @@ class OCSPView(View):
         if not ocsp_cert or ocsp_cert.status() != 'valid':
             return None
 
+        if use_signing_agent(ocsp_cert):
+            ocsp_key = AgentKey(
+                'sign_ocsp', name, ocsp_cert.serial,
+                ocsp_cert.x509.public_key(),
+            )
+        else:
+            ocsp_key = private_key_to_obj(
+                ocsp_cert.private_key, ocsp_cert.saved_password,
+            )
+
         builder_data = OCSPBuilderData(
-            ca_public_key=ca.public_key,
-            ocsp_public_key=ocsp_cert.public_key,
-            ocsp_private_key=ocsp_cert.private_key,
-            ocsp_private_key_passwd=ocsp_cert.saved_password,
+            ca_cert=public_key_to_obj(ca.public_key),
+            ocsp_cert=public_key_to_obj(ocsp_cert.public_key),
+            ocsp_key=ocsp_key,
             expires=time.time() + self._BUILDER_DATA_CACHE_TIME,
         )
         self._BUILDER_DATA_CACHE[name] = builder_data
@@ -67,21 +223,125 @@ class OCSPView(View):
             return self.load_builder_data(name)
         return builder_data
 
+    def get_cache_generation(self, name, generation=None):
+        cache, key = self.get_cache(), get_generation_cache_key(name)
+        if generation is None:
+            generation = cache.get(key, None)
+        if generation is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            generation = cache.get(key, None)
+        return generation
+
+    def get_local_response(self, name, serial, hash_algo):
+        # a hit hands out the cached bytes themselves, without any I/O
+        key = (name, serial, hash_algo)
+        with self._LOCAL_RESPONSES_LOCK:
+            response = self._LOCAL_RESPONSES.get(key, None)
+            if not response:
+                return None
+            if response.expires <= time.time():
+                del self._LOCAL_RESPONSES[key]
+                return None
+            self._LOCAL_RESPONSES.move_to_end(key)
+            return response.data
+
+    def set_local_response(self, name, serial, hash_algo, data, expires):
+        if settings.OCSP_LOCAL_CACHE_SIZE <= 0:
+            return
+        expires = min(expires, time.time() + settings.OCSP_LOCAL_CACHE_TIME)
+        with self._LOCAL_RESPONSES_LOCK:
+            self._LOCAL_RESPONSES[(name, serial, hash_algo)] = (
+                OCSPLocalResponse(data=data, expires=expires)
+            )
+            self._LOCAL_RESPONSES.move_to_end((name, serial, hash_algo))
+            while len(self._LOCAL_RESPONSES) > settings.OCSP_LOCAL_CACHE_SIZE:
+                self._LOCAL_RESPONSES.popitem(last=False)
+
+    def get_cached_response(self, name, serial, hash_algo):
+        data = self.get_local_response(name, serial, hash_algo)
+        if data:
+            return data
+        return self.get_shared_response(name, serial, hash_algo)
+
+    def set_cached_response(self, name, serial, hash_algo, data, expires):
+        self.set_local_response(name, serial, hash_algo, data, expires)
+        self.set_shared_response(name, serial, hash_algo, data, expires)
+
+    def get_shared_response(self, name, serial, hash_algo):
+        keys = [
+            get_generation_cache_key(name),
+            get_response_cache_key(name, serial, hash_algo),
+        ]
+        values = self.get_cache().get_many(keys)
+        self.cache_generation = self.get_cache_generation(
+            name, values.get(keys[0], None),
+        )
+
+        response_data = values.get(keys[1], None)
+        if not response_data or (
+            response_data.generation != self.cache_generation
+        ):
+            return None
+        self.set_local_response(
+            name, serial, hash_algo, response_data.data,
+            time.time() + settings.OCSP_LOCAL_CACHE_TIME,
+        )
+        return response_data.data
+
+    def set_shared_response(self, name, serial, hash_algo, data, expires):
+        timeout = int(expires - time.time())
+        if timeout <= 0:
+            return
+
+        generation = (
+            self.cache_generation or self.get_cache_generation(name)
+        )
+        self.get_cache().set(
+            get_response_cache_key(name, serial, hash_algo),
+            OCSPResponseData(data=data, generation=generation), timeout,
+        )
+
+    def get_presigned_response(self, name, serial, hash_algo):
+        try:
+            with open(get_presigned_path(name, serial, hash_algo), 'rb') as f:
+                data = f.read()
+            next_update = get_ocsp_update_times(data)[1]
+        except (OSError, ValueError):
+            return None
+
+        now = timezone.now()
+        if not next_update or next_update <= now:
+            return None
+
+        # other workers could drop the file on revocation; re-check it soon
+        expires = min(
+            next_update.timestamp(),
+            now.timestamp() + self._RESPONSE_CACHE_TIME,
+        )
+        self.set_cached_response(name, serial, hash_algo, data, expires)
+        return data
+
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
     def get(self, request, **kwargs):
-        try:
-            data = base64.base64decode(
-                urllib.parse.unquote(kwargs.pop('data'))
-            )
-        except:
-            data = ''
-        return self.process_ocsp_request(kwargs.pop('name'), data)
+        # without the request in the URL, only POST is answered
+        if 'data' not in kwargs:
+            return HttpResponseNotAllowed(['POST'])
+
+        name, data = self.decode_get_data(
+            kwargs.pop('name', None), kwargs.pop('data'),
+        )
+        response = self.process_ocsp_request(name, data)
+        if response.status_code == 200 and self.cacheable:
+            response = self.patch_cache_headers(request, response)
+        return response
 
     def post(self, request, **kwargs):
-        return self.process_ocsp_request(kwargs.pop('name'), request.body)
+        return self.process_ocsp_request(
+            kwargs.pop('name', None), request.body,
+        )
 
     def process_ocsp_request(self, name, data):
         status = 200
@@ -94,66 +354,149 @@ class OCSPView(View):
             response = self.fail('internal_error')
 
         return HttpResponse(
-            response.dump(), status=status,
+            response, status=status,
             content_type='application/ocsp-response',
         )
 
-    def fail(self, reason):
-        builder = OCSPResponseBuilder(response_status=reason)
-        return builder.build()
-
-    def get_ocsp_response(self, name, data):
-        builder_data = self.get_builder_data(name)
-        if not builder_data:
-            return self.fail('unauthorized')
+    def decode_get_data(self, name, data):
+        # unescaped base64 could contain '/', so it may look like a CA name
+        issuer_names = {i.name for i in self.get_issuer_index().values()}
+        if name is not None and name not in issuer_names:
+            name, data = None, f'{name}/{data}'
 
         try:
-            ocsp_request = OCSPRequest.load(data)
-            tbs_request = ocsp_request['tbs_request']
-            extensions = tbs_request['request_extensions']
-            request_list = tbs_request['request_list']
-            if len(request_list) != 1:
-                raise NotImplemented
-            req_cert = request_list[0]['req_cert']
-            serial = format_serial(req_cert['serial_number'].native)
-        except:
-            return self.fail('malformed_request')
+            return name, base64.b64decode(urllib.parse.unquote(data))
+        except ValueError:
+            return name, b''
 
-        cert = Certificate.objects.filter(serial=serial).first()
-        if not cert or cert.ca.name != name:
-            return self.fail('unauthorized')
+    def get_cache_headers(self, data):
+        this_update, next_update = get_ocsp_update_times(data)
+        max_age = max(int(next_update.timestamp() - time.time()), 0)
+        return {
+            'ETag': quote_etag(hashlib.sha1(data).hexdigest()),
+            'Last-Modified': http_date(this_update.timestamp()),
+            'Expires': http_date(next_update.timestamp()),
+            'Cache-Control': (
+                f'max-age={max_age}, public, no-transform, must-revalidate'
+            ),
+        }
 
-        builder = OCSPResponseBuilder(
-            response_status='successful',
-            certificate=public_key_to_obj(cert.public_key),
-            certificate_status=cert.status_ocsp(),
-            revocation_date=cert.revoked_at,
-        )
-        builder.next_update = (
-            datetime.utcnow()
-            + timedelta(seconds=self._RESPONSE_CACHE_TIME)
+    def patch_cache_headers(self, request, response):
+        headers = self.get_cache_headers(response.content)
+        for key, value in headers.items():
+            response[key] = value
+        return get_conditional_response(
+            request, etag=headers['ETag'],
+            last_modified=parse_http_date(headers['Last-Modified']),
+            response=response,
         )
 
-        for extension in extensions:
+    def fail(self, reason):
+        return build_ocsp_fail(reason)
+
+    def parse_ocsp_request(self, data):
+        ocsp_request = OCSPRequest.load(data)
+        tbs_request = ocsp_request['tbs_request']
+        request_list = tbs_request['request_list']
+        if not 0 < len(request_list) <= settings.OCSP_MAX_REQUESTS:
+            raise ValueError('Too many or no requests')
+
+        cert_ids = [(
+            req['req_cert']['hash_algorithm']['algorithm'].native,
+            req['req_cert']['issuer_name_hash'].native,
+            req['req_cert']['issuer_key_hash'].native,
+            req['req_cert']['serial_number'].native,
+        ) for req in request_list]
+
+        nonce = None
+        for extension in tbs_request['request_extensions']:
             key = extension['extn_id'].native
             value = extension['extn_value'].parsed
             critical = extension['critical'].native
 
             unknown = False
             if key == 'nonce':
-                builder.nonce = value.native
+                nonce = value.native
             else:
                 unknown = True
 
             if unknown and critical:
-                return self.fail('malformed_request')
+                raise ValueError(f'Unknown critical extension: {key}')
+        return cert_ids, nonce
+
+    def load_certificates(self, issuer, serials):
+        return {
+            serial: (revoked_at, revoked_reason)
+            for serial, revoked_at, revoked_reason in
+            Certificate.objects.filter(
+                ca_id=issuer.id, serial__in=serials,
+            ).values_list('serial', 'revoked_at', 'revoked_reason')
+        }
+
+    def sign_response(self, builder_data, entries, nonce,
+                      this_update, next_update):
+        single_responses = [build_single_response(
+            builder_data.ca_cert, hash_algo, serial_number,
+            get_ocsp_status(revoked_at, revoked_reason), revoked_at,
+            this_update, next_update,
+        ) for hash_algo, serial_number, revoked_at, revoked_reason in entries]
 
-        ca_cert = public_key_to_obj(builder_data.ca_public_key)
-        ocsp_cert = public_key_to_obj(builder_data.ocsp_public_key)
-        ocsp_key = private_key_to_obj(
-            builder_data.ocsp_private_key,
-            builder_data.ocsp_private_key_passwd,
+        return build_ocsp_response(
+            single_responses, builder_data.ocsp_cert,
+            builder_data.ocsp_key, nonce,
         )
 
-        builder.certificate_issuer = ca_cert
-        return builder.build(ocsp_key, ocsp_cert)
+    def sign_responses(self, builder_data, entries, this_update, next_update):
+        # one single response each, signed as a batch
+        return build_ocsp_responses([[build_single_response(
+            builder_data.ca_cert, hash_algo, serial_number,
+            get_ocsp_status(revoked_at, revoked_reason), revoked_at,
+            this_update, next_update,
+        )] for hash_algo, serial_number, revoked_at, revoked_reason in entries
+        ], builder_data.ocsp_cert, builder_data.ocsp_key)
+
+    def get_ocsp_response(self, name, data):
+        try:
+            cert_ids, nonce = self.parse_ocsp_request(data)
+        except:
+            return self.fail('malformed_request')
+
+        # all certificates should be issued by one CA, found by CertID
+        issuers = {self.get_issuer_data(*cert_id[:3]) for cert_id in cert_ids}
+        issuer = issuers.pop()
+        if issuers or not issuer or name not in [None, issuer.name]:
+            return self.fail('unauthorized')
+
+        # nonce-less requests can be answered with a pre-signed response
+        serials = [format_serial(cert_id[3]) for cert_id in cert_ids]
+        cacheable = nonce is None and len(cert_ids) == 1
+        if cacheable:
+            cache_key = (issuer.name, serials[0], cert_ids[0][0])
+            cached = (
+                self.get_cached_response(*cache_key)
+                or self.get_presigned_response(*cache_key)
+            )
+            if cached:
+                self.cacheable = True
+                return cached
+
+        builder_data = self.get_builder_data(issuer.name)
+        if not builder_data:
+            return self.fail('unauthorized')
+
+        certs = self.load_certificates(issuer, serials)
+        if any(serial not in certs for serial in serials):
+            return self.fail('unauthorized')
+
+        now = get_ocsp_time(timezone.now())
+        expires = now + timedelta(seconds=self._RESPONSE_CACHE_TIME)
+        response = self.sign_response(builder_data, [
+            (cert_id[0], cert_id[3]) + certs[serial]
+            for serial, cert_id in zip(serials, cert_ids)
+        ], nonce, now, expires)
+        if cacheable:
+            self.set_cached_response(
+                *cache_key, response, expires.timestamp(),
+            )
+        self.cacheable = cacheable
+        return response
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import resolve, Resolver404
+from django.utils import timezone
+
+from ca.core.internals import get_ocsp_time
+from ca.core.ocsp import OCSPView
+from ca.core.utils import format_serial
+
+
+def call_with_connection(func, *args):
+    close_old_connections()
+    return func(*args)
+
+
+class OCSPApplication:
+    max_body_size = 64 * 1024
+
+    def __init__(self):
+        self.db_executor = ThreadPoolExecutor(
+            max_workers=settings.OCSP_ASGI_DB_WORKERS,
+        )
+        self.sign_executor = ThreadPoolExecutor(
+            max_workers=settings.OCSP_ASGI_SIGN_WORKERS,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            return
+
+        try:
+            match = resolve(scope['path'])
+            if getattr(match.func, 'view_class', None) is not OCSPView:
+                raise Resolver404
+        except Resolver404:
+            return await self.respond(send, 404)
+
+        method = scope['method']
+        if method not in ['GET', 'HEAD', 'POST']:
+            return await self.respond(send, 405, headers={
+                'Allow': 'GET, HEAD, POST',
+            })
+
+        if method != 'POST' and 'data' not in match.kwargs:
+            return await self.respond(send, 405, headers={'Allow': 'POST'})
+
+        view = OCSPView()
+        body = await self.read_body(receive)
+        name = match.kwargs.get('name', None)
+        if method == 'POST':
+            data = body
+        else:
+            await self.refresh_issuer_index()
+            name, data = view.decode_get_data(name, match.kwargs['data'])
+
+        status, headers = 200, {}
+        try:
+            response = await self.get_ocsp_response(view, name, data)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            status, response = 500, view.fail('internal_error')
+
+        if method != 'POST' and status == 200 and view.cacheable:
+            headers = view.get_cache_headers(response)
+            if_none_match = dict(scope['headers']).get(b'if-none-match', b'')
+            etags = [e.strip() for e in if_none_match.decode().split(',')]
+            if headers['ETag'] in etags or '*' in etags:
+                return await self.respond(send, 304, headers=headers)
+
+        headers['Content-Type'] = 'application/ocsp-response'
+        if method == 'HEAD':
+            headers['Content-Length'] = str(len(response))
+            response = b''
+        return await self.respond(send, status, response, headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.run_db(OCSPView.warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.db_executor.shutdown()
+                self.sign_executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body, more_body = b'', True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if len(body) > self.max_body_size:
+                return b''
+        return body
+
+    async def respond(self, send, status, body=b'', headers=None):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (k.lower().encode('latin-1'), v.encode('latin-1'))
+                for k, v in headers.items()
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def run_db(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.db_executor, call_with_connection, func, *args,
+        )
+
+    async def run_io(self, func, *args):
+        # the shared cache is read from disk, never on the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.db_executor, func, *args)
+
+    async def run_sign(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.sign_executor, func, *args)
+
+    async def refresh_issuer_index(self):
+        if time.time() > OCSPView._ISSUER_INDEX_EXPIRES:
+            await self.run_db(OCSPView.load_issuer_index)
+
+    async def get_ocsp_response(self, view, name, data):
+        try:
+            cert_ids, nonce = view.parse_ocsp_request(data)
+        except Exception:
+            return view.fail('malformed_request')
+
+        # all certificates should be issued by one CA, found by CertID
+        await self.refresh_issuer_index()
+        issuers = {view.get_issuer_data(*cert_id[:3]) for cert_id in cert_ids}
+        issuer = issuers.pop()
+        if issuers or not issuer or name not in [None, issuer.name]:
+            return view.fail('unauthorized')
+
+        # cache hits are answered without going through the database pool
+        serials = [format_serial(cert_id[3]) for cert_id in cert_ids]
+        cacheable = nonce is None and len(cert_ids) == 1
+        if cacheable:
+            cache_key = (issuer.name, serials[0], cert_ids[0][0])
+            cached = view.get_local_response(*cache_key)
+            if not cached:
+                cached = await self.run_io(
+                    view.get_shared_response, *cache_key,
+                )
+            if not cached:
+                cached = await self.run_db(
+                    view.get_presigned_response, *cache_key,
+                )
+            if cached:
+                view.cacheable = True
+                return cached
+
+        builder_data = await self.run_db(view.get_builder_data, issuer.name)
+        if not builder_data:
+            return view.fail('unauthorized')
+
+        certs = await self.run_db(view.load_certificates, issuer, serials)
+        if any(serial not in certs for serial in serials):
+            return view.fail('unauthorized')
+
+        now = get_ocsp_time(timezone.now())
+        expires = now + timedelta(seconds=view._RESPONSE_CACHE_TIME)
+        response = await self.run_sign(view.sign_response, builder_data, [
+            (cert_id[0], cert_id[3]) + certs[serial]
+            for serial, cert_id in zip(serials, cert_ids)
+        ], nonce, now, expires)
+        if cacheable:
+            view.set_local_response(*cache_key, response, expires.timestamp())
+            await self.run_io(
+                view.set_shared_response,
+                *cache_key, response, expires.timestamp(),
+            )
+        view.cacheable = cacheable
+        return response
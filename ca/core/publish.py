@@ -0,0 +1,408 @@
+import hashlib
+import hmac
+import http.client
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from os import path
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_CONTENT_TYPES = {
+    '.crl': 'application/pkix-crl',
+    '.pem': 'application/x-pem-file',
+    '.der': 'application/ocsp-response',
+    '.sha256': 'text/plain',
+}
+
+_PUBLISH_EXECUTOR = (None, None)
+_PUBLISH_TASKS = set()
+_UPLOAD_EXECUTOR = (None, None)
+_BACKENDS = (None, None, {})
+
+# deferred publications fail after the caller has returned; they are
+# counted here, per process
+PUBLISH_STATS = {'failures': 0, 'last_error': None}
+
+
+def get_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_content_type(name):
+    return PUBLISH_CONTENT_TYPES.get(
+        path.splitext(name)[1], 'application/octet-stream',
+    )
+
+
+def write_file_atomic(file_path, data, fsync=True):
+    # readers see either the old or the new file, never a partial one
+    # threads of one process could write the same file at once
+    fd, tmp_file_path = tempfile.mkstemp(
+        dir=path.dirname(file_path) or '.',
+        prefix=f'.{path.basename(file_path)}.', suffix='.tmp',
+    )
+    try:
+        # published files are world readable, unlike mkstemp's
+        os.fchmod(fd, 0o644)
+        with open(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_file_path)
+        except FileNotFoundError:
+            pass
+        raise
+    if not fsync:
+        return
+
+    # the rename is durable only once the directory is synced
+    dir_fd = os.open(path.dirname(file_path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def write_files(files):
+    for file_path, data in files:
+        write_file_atomic(file_path, data)
+
+
+class PublishBackend:
+    def get_digest(self, name):
+        return None
+
+    def write(self, name, data, digest):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def sweep(self):
+        pass
+
+    def publish(self, name, data):
+        # unchanged content is never written again
+        digest = get_digest(data)
+        if self.get_digest(name) == digest:
+            return False
+        self.write(name, data, digest)
+        return True
+
+
+class LocalDirectoryBackend(PublishBackend):
+    def __init__(self, location, fsync=True):
+        self.location = location
+        self.fsync = fsync
+
+    def get_path(self, name):
+        return path.join(self.location, name)
+
+    def get_digest(self, name):
+        try:
+            with open(self.get_path(name), 'rb') as f:
+                return get_digest(f.read())
+        except OSError:
+            return None
+
+    def write(self, name, data, digest):
+        file_path = self.get_path(name)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        write_file_atomic(file_path, data, self.fsync)
+
+    def delete(self, name):
+        try:
+            os.remove(self.get_path(name))
+        except FileNotFoundError:
+            pass
+
+
+class ContentAddressedBackend(LocalDirectoryBackend):
+    """Stores each content once under its digest; names are symlinks.
+
+    Objects no name links to any more are deleted by sweep, at most once
+    every sweep_interval seconds, once they are older than sweep_grace.
+    """
+
+    def __init__(self, location, fsync=True, sweep_interval=60 * 60,
+                 sweep_grace=60 * 10):
+        super().__init__(location, fsync)
+        self.sweep_interval = sweep_interval
+        self.sweep_grace = sweep_grace
+        self.next_sweep = 0
+        self.lock = threading.Lock()
+
+    def get_object_path(self, digest):
+        return path.join(self.location, '.objects', digest[:2], digest)
+
+    def get_digest(self, name):
+        try:
+            return path.basename(os.readlink(self.get_path(name)))
+        except OSError:
+            return None
+
+    def write(self, name, data, digest):
+        # an object is touched, so a sweep never deletes it while linked
+        object_path = self.get_object_path(digest)
+        try:
+            os.utime(object_path)
+        except FileNotFoundError:
+            os.makedirs(path.dirname(object_path), exist_ok=True)
+            write_file_atomic(object_path, data, self.fsync)
+
+        # a symlink can not be overwritten, but it can be renamed over
+        file_path = self.get_path(name)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        tmp_file_path = path.join(
+            path.dirname(file_path),
+            f'.{path.basename(file_path)}.{uuid.uuid4().hex}.tmp',
+        )
+        os.symlink(path.relpath(object_path, path.dirname(file_path)),
+                   tmp_file_path)
+        os.replace(tmp_file_path, file_path)
+
+    def sweep(self):
+        with self.lock:
+            if time.time() < self.next_sweep:
+                return
+            self.next_sweep = time.time() + self.sweep_interval
+
+        # objects and tmp links written just now could be linked yet
+        objects_dir = path.join(self.location, '.objects')
+        deadline = time.time() - self.sweep_grace
+        linked = set()
+        for dir_path, dir_names, file_names in os.walk(self.location):
+            if dir_path == self.location and '.objects' in dir_names:
+                dir_names.remove('.objects')
+            for file_name in file_names:
+                file_path = path.join(dir_path, file_name)
+                try:
+                    if file_name.endswith('.tmp') and \
+                            os.lstat(file_path).st_mtime < deadline:
+                        os.remove(file_path)
+                    else:
+                        linked.add(path.basename(os.readlink(file_path)))
+                except OSError:
+                    pass
+
+        for dir_path, _, file_names in os.walk(objects_dir):
+            for file_name in file_names:
+                if file_name in linked:
+                    continue
+                file_path = path.join(dir_path, file_name)
+                try:
+                    if os.stat(file_path).st_mtime < deadline:
+                        os.remove(file_path)
+                except OSError:
+                    pass
+
+
+class S3Backend(PublishBackend):
+    """Publishes to an S3-compatible object store with path-style URLs."""
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key,
+                 region='us-east-1', prefix='', timeout=30):
+        url = urlsplit(endpoint_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.host = url.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.connection_class(
+                self.host, timeout=self.timeout,
+            )
+            self.local.connection = connection
+        return connection
+
+    def sign(self, method, url_path, headers, payload_digest):
+        # AWS Signature Version 4, with an empty query string
+        now = datetime.utcnow()
+        amz_date, date = now.strftime('%Y%m%dT%H%M%SZ'), now.strftime('%Y%m%d')
+        headers.update({
+            'host': self.host, 'x-amz-date': amz_date,
+            'x-amz-content-sha256': payload_digest,
+        })
+
+        canonical_headers = sorted(
+            (k.lower(), str(v).strip()) for k, v in headers.items()
+        )
+        signed_headers = ';'.join(k for k, _ in canonical_headers)
+        canonical_request = '\n'.join([
+            method, url_path, '',
+            ''.join(f'{k}:{v}\n' for k, v in canonical_headers),
+            signed_headers, payload_digest,
+        ])
+        scope = f'{date}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            get_digest(canonical_request.encode()),
+        ])
+
+        key = f'AWS4{self.secret_key}'.encode()
+        for part in [date, self.region, 's3', 'aws4_request']:
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(
+            key, string_to_sign.encode(), hashlib.sha256,
+        ).hexdigest()
+        headers['Authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+            f'SignedHeaders={signed_headers}, Signature={signature}'
+        )
+
+    def request(self, method, name, data=b'', headers=None):
+        url_path = quote(f'/{self.bucket}/{self.prefix}{name}', safe='/~')
+        headers = dict(headers or {})
+        self.sign(method, url_path, headers, get_digest(data))
+
+        # a kept-alive connection could have been closed by the server
+        for retry in [True, False]:
+            connection = self.get_connection()
+            try:
+                connection.request(method, url_path, data, headers)
+                response = connection.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self.local.connection = None
+                if not retry:
+                    raise
+
+    def get_digest(self, name):
+        status, headers, _ = self.request('HEAD', name)
+        if status != 200:
+            return None
+        return headers.get('x-amz-meta-sha256', None)
+
+    def write(self, name, data, digest):
+        status, _, body = self.request('PUT', name, data, {
+            'content-type': get_content_type(name),
+            'x-amz-meta-sha256': digest,
+        })
+        if status != 200:
+            raise IOError(f'S3 PUT {name} failed with {status}: {body[:200]}')
+
+    def delete(self, name):
+        status, _, body = self.request('DELETE', name)
+        if status not in [200, 204, 404]:
+            raise IOError(f'S3 DELETE {name} failed with {status}')
+
+
+def get_backends(target):
+    global _BACKENDS
+
+    # backends could hold connections; never share them with a fork
+    pid, targets, backends = _BACKENDS
+    if pid != os.getpid() or targets is not settings.PUBLISH_TARGETS:
+        backends = {}
+        _BACKENDS = (os.getpid(), settings.PUBLISH_TARGETS, backends)
+    if target not in backends:
+        backends[target] = [
+            import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            for config in settings.PUBLISH_TARGETS.get(target, [])
+        ]
+    return backends[target]
+
+
+def get_executor(executor, max_workers):
+    pid, pool = executor
+    if pid != os.getpid():
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    return os.getpid(), pool
+
+
+def publish_to_backend(backend, files, removals):
+    # files are published in order, so an index could go last
+    count = 0
+    for name, data in files:
+        count += backend.publish(name, data)
+    for name in removals:
+        backend.delete(name)
+    backend.sweep()
+    return count
+
+
+def publish(target, files, removals):
+    global _UPLOAD_EXECUTOR
+
+    # targets are uploaded to in parallel
+    _UPLOAD_EXECUTOR = get_executor(
+        _UPLOAD_EXECUTOR, settings.PUBLISH_WORKERS,
+    )
+    tasks = [_UPLOAD_EXECUTOR[1].submit(
+        publish_to_backend, backend, files, removals,
+    ) for backend in get_backends(target)]
+    return sum(task.result() for task in tasks)
+
+
+def run_with_retries(func, *args):
+    for retry in range(settings.PUBLISH_RETRIES, -1, -1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if not retry:
+                # counted before the task is done, so waiters see it
+                PUBLISH_STATS['failures'] += 1
+                PUBLISH_STATS['last_error'] = str(e)
+                raise
+            logger.warning('Failed to publish files; retrying', exc_info=True)
+            time.sleep(settings.PUBLISH_RETRY_DELAY)
+
+
+def on_published(task):
+    _PUBLISH_TASKS.discard(task)
+    if task.exception():
+        logger.error('Failed to publish files', exc_info=task.exception())
+
+
+def defer(func, *args):
+    global _PUBLISH_EXECUTOR
+
+    if not settings.PUBLISH_ASYNC:
+        func(*args)
+        return
+
+    # one writer thread per process keeps publications in order
+    if _PUBLISH_EXECUTOR[0] != os.getpid():
+        _PUBLISH_TASKS.clear()
+    _PUBLISH_EXECUTOR = get_executor(_PUBLISH_EXECUTOR, 1)
+    task = _PUBLISH_EXECUTOR[1].submit(run_with_retries, func, *args)
+    _PUBLISH_TASKS.add(task)
+    task.add_done_callback(on_published)
+
+
+def publish_files(target, files):
+    defer(publish, target, files, [])
+
+
+def unpublish_files(target, names):
+    defer(publish, target, [], names)
+
+
+def flush_published():
+    wait(list(_PUBLISH_TASKS))
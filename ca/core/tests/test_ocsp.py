@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+
+from asn1crypto import x509 as asn1_x509
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import NameOID
+from django.test import SimpleTestCase
+
+from ca.core.internals import (
+    build_ocsp_response, build_single_response, generate_privkey,
+    get_ocsp_status,
+)
+
+
+def make_responder(algorithm='ec', key_size=256):
+    key = generate_privkey(key_size, algorithm)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test')])
+    now = datetime.now(timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name,
+    ).public_key(key.public_key()).serial_number(
+        x509.random_serial_number(),
+    ).not_valid_before(now).not_valid_after(
+        now + timedelta(days=1),
+    ).sign(key, None if algorithm == 'ed25519' else hashes.SHA256())
+    return (
+        asn1_x509.Certificate.load(cert.public_bytes(Encoding.DER)), key,
+    )
+
+
+class OCSPResponseTest(SimpleTestCase):
+    def build(self, revoked_at=None, revoked_reason=None,
+              algorithm='ec', key_size=256):
+        cert, key = make_responder(algorithm, key_size)
+        self.public_key = key.public_key()
+        # microseconds everywhere, as timezone.now() and the database give
+        this_update = datetime.now(timezone.utc).replace(microsecond=123456)
+        single_response = build_single_response(
+            cert, 'sha1', 1234, get_ocsp_status(revoked_at, revoked_reason),
+            revoked_at, this_update, this_update + timedelta(hours=1),
+        )
+        data = build_ocsp_response([single_response], cert, key)
+        # cryptography rejects fractional GeneralizedTime
+        return ocsp.load_der_ocsp_response(data)
+
+    def test_good(self):
+        response = self.build()
+        self.assertEqual(
+            response.response_status, ocsp.OCSPResponseStatus.SUCCESSFUL,
+        )
+        self.assertEqual(response.certificate_status, ocsp.OCSPCertStatus.GOOD)
+        self.assertEqual(response.serial_number, 1234)
+        self.assertEqual(response.produced_at.microsecond, 0)
+        self.assertEqual(response.this_update.microsecond, 0)
+
+    def test_revoked(self):
+        revoked_at = datetime.now(timezone.utc).replace(microsecond=654321)
+        response = self.build(revoked_at, 'key_compromise')
+        self.assertEqual(
+            response.certificate_status, ocsp.OCSPCertStatus.REVOKED,
+        )
+        self.assertEqual(
+            response.revocation_time,
+            revoked_at.replace(microsecond=0, tzinfo=None),
+        )
+        self.assertEqual(
+            response.revocation_reason, x509.ReasonFlags.key_compromise,
+        )
+
+    def test_signature_algorithm(self):
+        # the hash follows the responder key, as for certificates and CRLs
+        for algorithm, key_size, signature_algorithm in [
+            ('rsa', 2048, 'sha256WithRSAEncryption'),
+            ('ec', 256, 'ecdsa-with-SHA256'),
+            ('ec', 384, 'ecdsa-with-SHA384'),
+            ('ed25519', 256, 'ed25519'),
+        ]:
+            response = self.build(algorithm=algorithm, key_size=key_size)
+            self.assertEqual(
+                response.signature_algorithm_oid._name, signature_algorithm,
+            )
+            args = [response.signature, response.tbs_response_bytes]
+            if algorithm == 'rsa':
+                args += [padding.PKCS1v15(), response.signature_hash_algorithm]
+            elif algorithm == 'ec':
+                args += [ec.ECDSA(response.signature_hash_algorithm)]
+            self.public_key.verify(*args)
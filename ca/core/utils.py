@@ -114,11 +114,20 @@ def format_general_names(names):
     return '\n'.join([format_general_name(name) for name in names])
 
 
+def split_urls(urls):
+    return [url.strip() for url in urls.splitlines() if url.strip()]
+
+
 def format_serial(serial):
     if isinstance(serial, int):
         s = hex(serial)[2:].upper()
+        s = '0' * (len(s) % 2) + s
     elif isinstance(serial, bytes):
         s = binascii.hexlify(serial).upper().decode('utf-8')
     else:
         s = str(serial)
     return ':'.join(a + b for a, b in zip(s[::2], s[1::2]))
+
+
+def parse_serial(serial):
+    return int(serial.replace(':', ''), 16)
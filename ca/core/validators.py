@@ -1,6 +1,7 @@
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
 
+from ca.core.constants import KEY_SIZES
 from ca.core.utils import parse_general_name
 
 
@@ -31,10 +32,9 @@ def validate_general_name_multiline(value):
 
 
 def validate_key_size(value):
-    if value < 2048:
-        raise ValidationError('Key size should be at least 2048b')
-    elif value & (value - 1) != 0:
-        raise ValidationError('Key size should be multiple of 2')
+    # the size is checked against the key algorithm in Profile.clean
+    if not any(value in sizes for sizes in KEY_SIZES.values()):
+        raise ValidationError('Key size is not supported by any algorithm')
 
 
 def validate_url_multiline(value):
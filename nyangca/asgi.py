@@ -0,0 +1,17 @@
+"""
+ASGI config for nyangca project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Only the OCSP responder is served here; the admin site stays on WSGI.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nyangca.ocsp_settings")
+django.setup()
+
+from ca.core.ocsp_asgi import OCSPApplication  # noqa: E402
+
+application = OCSPApplication()
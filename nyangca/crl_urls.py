@@ -0,0 +1,14 @@
+"""nyangca CRL URL Configuration
+
+Serves the live CRLs published by CertificateAuthorityManager.refresh_crl.
+"""
+from django.conf.urls import url
+
+from ca.core.crl import CRLView
+
+urlpatterns = [
+    url(
+        r'^crl/(?P<name>[\w-]{1,32}(\.delta)?(\.\d{1,3})?\.crl)'
+        r'(?P<pem>\.pem)?$', CRLView.as_view(),
+    ),
+]
@@ -0,0 +1,28 @@
+"""
+Gunicorn config for the standalone OCSP responder of nyangca project.
+
+    gunicorn -c nyangca/ocsp_gunicorn.py
+
+The ASGI responder is served by uvicorn instead:
+
+    uvicorn nyangca.asgi:application --workers 4
+"""
+
+import multiprocessing
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nyangca.ocsp_settings")
+
+wsgi_app = 'nyangca.ocsp_wsgi:application'
+bind = os.environ.get('OCSP_BIND', '127.0.0.1:8080')
+workers = int(os.environ.get('OCSP_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = 4
+# the app is imported, and settings checked, once in the master
+preload_app = True
+
+
+def post_worker_init(worker):
+    # every worker signs with its own copy of the OCSP keys
+    from ca.core.ocsp import OCSPView
+    OCSPView.warm_up()
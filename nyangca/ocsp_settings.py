@@ -0,0 +1,23 @@
+"""
+Django settings for the standalone OCSP responder of nyangca project.
+
+Only the apps required by the OCSP models are installed, so the admin site,
+forms and templates are never imported by responder processes.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'ca.core',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = 'nyangca.ocsp_urls'
+
+TEMPLATES = []
+
+WSGI_APPLICATION = 'nyangca.ocsp_wsgi.application'
@@ -0,0 +1,14 @@
+"""nyangca OCSP URL Configuration
+
+Shared by the full site (nyangca.urls) and the standalone OCSP responder.
+"""
+from django.conf.urls import url
+
+from ca.core.ocsp import OCSPView
+
+urlpatterns = [
+    url(r'^ocsp$', OCSPView.as_view()),
+    url(r'^ocsp/(?P<name>[\w-]{1,32})$', OCSPView.as_view()),
+    url(r'^ocsp/(?P<name>[\w-]{1,32})/(?P<data>.+)$', OCSPView.as_view()),
+    url(r'^ocsp/(?P<data>.+)$', OCSPView.as_view()),
+]
@@ -80,6 +80,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared by the OCSP workers of a host; only expired entries are
+    # swept, every CULL_INTERVAL seconds. memcached or redis work as well,
+    # if they never evict the per-CA generation keys
+    'ocsp': {
+        'BACKEND': 'ca.core.cache.OCSPFileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'storage/cache/ocsp/'),
+        'OPTIONS': {
+            'CULL_INTERVAL': 60,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -131,6 +151,13 @@ MASTER_PASSWORD_ARGS = {
     'p': 1,
 }
 
+# Keep keys derived from MASTER_PASSWORD in memory; 0 derives on every use
+# Evicted keys are dropped, not wiped: the cached Fernet objects hold them
+# as immutable bytes, so they stay in process memory until reused
+MASTER_PASSWORD_CACHE_TTL = 60 * 60
+
+MASTER_PASSWORD_CACHE_SIZE = 256
+
 
 # CA CRL Storage Directory
 STORAGE_CRL_DIR = os.path.join(BASE_DIR, 'storage/crl/')
@@ -139,6 +166,82 @@ STORAGE_CRL_LIVE_DIR = os.path.join(STORAGE_CRL_DIR, 'live/')
 
 STORAGE_CRL_ARCHIVE_DIR = os.path.join(STORAGE_CRL_DIR, 'archive/')
 
+CRL_DELTA_EXPIRE_DAYS = 1
+
+
+# CA CRL Archive Retention; keep one CRL per hour, then one per day
+CRL_ARCHIVE_HOURLY_DAYS = 7
+
+CRL_ARCHIVE_DAILY_DAYS = 365
+
+CRL_ARCHIVE_PACK_AFTER = 60 * 60
+
+
+# CA Signing Agent; when set, keys unlocked by saved passwords are held
+# by `manage.py signd` and never loaded into this process
+SIGNING_AGENT_SOCKET = None
+
+SIGNING_AGENT_TIMEOUT = 30
+
+
+# Pre-generated Keys of certificates (never of CAs); keypoold keeps
+# KEY_POOL_SIZE keys of every (algorithm, key size) and refills once below
+# KEY_POOL_LOW_WATERMARK
+KEY_POOL_KEYS = [('rsa', 4096), ('ec', 256)]
+
+KEY_POOL_SIZE = 32
+
+KEY_POOL_LOW_WATERMARK = 8
+
+
+# CA Pre-signed OCSP Response Storage Directory
+STORAGE_OCSP_DIR = os.path.join(BASE_DIR, 'storage/ocsp/')
+
+
+# Publication Targets of CRLs and Pre-signed OCSP Responses
+# Backends: ca.core.publish.LocalDirectoryBackend, ContentAddressedBackend,
+# S3Backend (endpoint_url, bucket, access_key, secret_key, region, prefix)
+PUBLISH_TARGETS = {
+    'crl': [{
+        'BACKEND': 'ca.core.publish.LocalDirectoryBackend',
+        'OPTIONS': {'location': STORAGE_CRL_LIVE_DIR},
+    }],
+    'ocsp': [{
+        'BACKEND': 'ca.core.publish.LocalDirectoryBackend',
+        'OPTIONS': {'location': STORAGE_OCSP_DIR, 'fsync': False},
+    }],
+}
+
+# Write published files in a background thread
+PUBLISH_ASYNC = True
+
+PUBLISH_WORKERS = 8
+
+# Deferred publications are retried before they count as failed
+PUBLISH_RETRIES = 2
+
+PUBLISH_RETRY_DELAY = 5
+
+
+# OCSP Responder
+OCSP_CACHE = 'ocsp'
+
+# Responses are kept in each worker too, in front of OCSP_CACHE; other
+# workers see a revocation within OCSP_LOCAL_CACHE_TIME seconds
+OCSP_LOCAL_CACHE_SIZE = 10000
+
+OCSP_LOCAL_CACHE_TIME = 5
+
+OCSP_MAX_REQUESTS = 16
+
+OCSP_PRESIGN_HASH_ALGOS = ['sha1']
+
+OCSP_PRESIGN_VALIDITY = 60 * 60 * 24
+
+OCSP_ASGI_DB_WORKERS = 16
+
+OCSP_ASGI_SIGN_WORKERS = os.cpu_count()
+
 
 try:
     from .local_settings import *  # noqa: F401,F403
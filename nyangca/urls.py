@@ -13,13 +13,11 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
-from ca.core.ocsp import OCSPView
-
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
-    url(r'^ocsp/(?P<name>\w+)$', OCSPView.as_view()),
-    url(r'^ocsp/(?P<name>\w+)/(?P<data>[^/]+)$', OCSPView.as_view()),
+    url(r'^', include('nyangca.crl_urls')),
+    url(r'^', include('nyangca.ocsp_urls')),
 ]